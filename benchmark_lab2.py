@@ -1,81 +1,327 @@
+import asyncio
+import json
+import multiprocessing
+import random
 import socket
-import threading
 import time
 import sys
 from datetime import datetime
 
-def make_request(client_id, host, port, path, results, delay=0):
-    if delay > 0:
-        time.sleep(delay)
+PERCENTILES = (50, 90, 99, 99.9)
+
+class ResponseError(Exception):
+    pass
+
+async def read_response(reader):
+    """
+    Read one HTTP response from a stream.
     
-    start_time = time.time()
+    Returns:
+        (status_code, body_length, keep_alive)
+    """
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        raise ResponseError("connection closed before response") from e
     
+    lines = head.decode('iso-8859-1').split('\r\n')
     try:
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client_socket.settimeout(10)
-        client_socket.connect((host, port))
-        
-        request = f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n\r\n"
-        client_socket.send(request.encode('utf-8'))
-        
-        response_data = b""
+        status_code = int(lines[0].split(' ')[1])
+    except (IndexError, ValueError) as e:
+        raise ResponseError(f"bad status line: {lines[0]!r}") from e
+    
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    
+    keep_alive = headers.get('connection', '').lower() != 'close'
+    
+    if 'content-length' in headers:
+        length = int(headers['content-length'])
+        await reader.readexactly(length)
+        return status_code, length, keep_alive
+    
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        length = 0
         while True:
-            chunk = client_socket.recv(4096)
-            if not chunk:
-                break
-            response_data += chunk
-        
-        client_socket.close()
-        
-        elapsed = time.time() - start_time
-        
-        response_str = response_data.decode('utf-8', errors='ignore')
-        status_line = response_str.split('\r\n')[0]
-        status_code = int(status_line.split(' ')[1])
+            size_line = await reader.readuntil(b"\r\n")
+            size = int(size_line.split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            length += size
+            if size == 0:
+                return status_code, length, keep_alive
+    
+    # No framing: the body runs until the server closes the connection.
+    body = await reader.read()
+    return status_code, len(body), False
+
+class LoadConnection:
+    """One client connection, reopened whenever the server closes it."""
+    
+    def __init__(self, host, port, keep_alive, timeout):
+        self.host = host
+        self.port = port
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+    
+    async def request(self, path):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout
+            )
         
-        results.append({
-            'client_id': client_id,
-            'elapsed': elapsed,
-            'status_code': status_code,
-            'success': status_code == 200
-        })
+        connection = "keep-alive" if self.keep_alive else "close"
+        self.writer.write(
+            f"GET {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+            f"Connection: {connection}\r\n\r\n".encode('utf-8')
+        )
         
-        return True
+        try:
+            status_code, length, server_keep_alive = await asyncio.wait_for(
+                read_response(self.reader), self.timeout
+            )
+        except BaseException:
+            self.close()
+            raise
         
-    except Exception as e:
-        elapsed = time.time() - start_time
-        results.append({
-            'client_id': client_id,
-            'elapsed': elapsed,
-            'status_code': 0,
-            'success': False,
-            'error': str(e)
-        })
-        return False
+        if not (self.keep_alive and server_keep_alive):
+            self.close()
+        return status_code, length
+    
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
 
-def test_concurrent_requests(host, port, num_clients, path='/'):
+class LoadRecorder:
+    """Collects outcomes, ignoring anything that started during warm-up."""
+    
+    def __init__(self, measure_from):
+        self.measure_from = measure_from
+        self.latencies = []
+        self.status_codes = {}
+        self.errors = {}
+        self.bytes_received = 0
+    
+    def record(self, started_at, latency, status_code=None, length=0, error=None):
+        if started_at < self.measure_from:
+            return
+        if error is not None:
+            name = type(error).__name__
+            self.errors[name] = self.errors.get(name, 0) + 1
+            return
+        self.latencies.append(latency)
+        self.status_codes[status_code] = self.status_codes.get(status_code, 0) + 1
+        self.bytes_received += length
+
+async def _issue(connection, path, recorder, started_at):
+    try:
+        status_code, length = await connection.request(path)
+    except (OSError, asyncio.TimeoutError, ResponseError, ValueError) as e:
+        recorder.record(started_at, time.perf_counter() - started_at, error=e)
+        return
+    recorder.record(started_at, time.perf_counter() - started_at, status_code, length)
+
+async def _closed_loop(host, port, pick_path, connections, keep_alive, timeout,
+                       recorder, deadline):
+    async def client():
+        connection = LoadConnection(host, port, keep_alive, timeout)
+        try:
+            while time.perf_counter() < deadline:
+                await _issue(connection, pick_path(), recorder, time.perf_counter())
+        finally:
+            connection.close()
+    
+    await asyncio.gather(*(client() for _ in range(connections)))
+
+async def _open_loop(host, port, pick_path, connections, keep_alive, timeout,
+                     recorder, deadline, rate):
+    # Requests are scheduled at fixed intervals and their latency is
+    # measured from the scheduled time, so a stalled server shows up as
+    # queueing delay instead of silently lowering the offered load.
+    idle = [LoadConnection(host, port, keep_alive, timeout) for _ in range(connections)]
+    slots = asyncio.Semaphore(connections)
+    tasks = set()
+    
+    async def fire(scheduled_at):
+        async with slots:
+            connection = idle.pop()
+            try:
+                await _issue(connection, pick_path(), recorder, scheduled_at)
+            finally:
+                idle.append(connection)
+    
+    interval = 1.0 / rate
+    next_at = time.perf_counter()
+    while next_at < deadline:
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.ensure_future(fire(next_at))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        next_at += interval
+    
+    if tasks:
+        await asyncio.wait(tasks, timeout=timeout)
+    for connection in idle:
+        connection.close()
+
+def _path_picker(path_mix, seed):
+    paths = [path for path, _ in path_mix]
+    weights = [weight for _, weight in path_mix]
+    rng = random.Random(seed)
+    if len(paths) == 1:
+        return lambda: paths[0]
+    return lambda: rng.choices(paths, weights)[0]
+
+def _run_load_process(host, port, path_mix, connections, duration, warmup, rate,
+                      keep_alive, timeout, seed):
+    """Drive load from a single event loop and return the raw measurements."""
+    start = time.perf_counter()
+    recorder = LoadRecorder(start + warmup)
+    deadline = start + warmup + duration
+    pick_path = _path_picker(path_mix, seed)
+    
+    if rate:
+        coroutine = _open_loop(host, port, pick_path, connections, keep_alive, timeout,
+                               recorder, deadline, rate)
+    else:
+        coroutine = _closed_loop(host, port, pick_path, connections, keep_alive, timeout,
+                                 recorder, deadline)
+    asyncio.run(coroutine)
+    
+    return {
+        'latencies': recorder.latencies,
+        'status_codes': recorder.status_codes,
+        'errors': recorder.errors,
+        'bytes_received': recorder.bytes_received,
+        'elapsed': time.perf_counter() - recorder.measure_from
+    }
+
+def _run_load_args(args):
+    return _run_load_process(*args)
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(-(-pct * len(sorted_values) // 100)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def run_load(host, port, path_mix, connections=32, duration=10, warmup=2, rate=None,
+             keep_alive=True, timeout=10, processes=1, seed=0):
+    """
+    Generate load against a server and summarise it.
+    
+    Closed loop (rate=None): each connection sends its next request as soon
+    as the previous response arrives. Open loop: requests are sent at a
+    constant total rate of `rate` per second, whatever the server's speed.
+    Connections and rate are split evenly across `processes` event loops.
+    
+    Returns:
+        dict ready to be serialised as JSON
+    """
+    processes = max(1, processes)
+    per_process_connections = max(1, connections // processes)
+    per_process_rate = rate / processes if rate else None
+    jobs = [
+        (host, port, path_mix, per_process_connections, duration, warmup,
+         per_process_rate, keep_alive, timeout, seed + index)
+        for index in range(processes)
+    ]
+    
+    if processes == 1:
+        parts = [_run_load_process(*jobs[0])]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            parts = pool.map(_run_load_args, jobs)
+    
+    latencies = sorted(latency for part in parts for latency in part['latencies'])
+    status_codes = {}
+    errors = {}
+    for part in parts:
+        for code, count in part['status_codes'].items():
+            status_codes[str(code)] = status_codes.get(str(code), 0) + count
+        for name, count in part['errors'].items():
+            errors[name] = errors.get(name, 0) + count
+    elapsed = max(part['elapsed'] for part in parts)
+    completed = len(latencies)
+    
+    latency_ms = {
+        'min': latencies[0] * 1000 if latencies else 0.0,
+        'mean': sum(latencies) / completed * 1000 if latencies else 0.0,
+        'max': latencies[-1] * 1000 if latencies else 0.0
+    }
+    for pct in PERCENTILES:
+        latency_ms[f'p{pct:g}'] = percentile(latencies, pct) * 1000
+    
+    return {
+        'config': {
+            'host': host,
+            'port': port,
+            'mode': 'open' if rate else 'closed',
+            'rate': rate,
+            'connections': per_process_connections * processes,
+            'processes': processes,
+            'duration': duration,
+            'warmup': warmup,
+            'keep_alive': keep_alive,
+            'paths': [{'path': path, 'weight': weight} for path, weight in path_mix]
+        },
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'elapsed': elapsed,
+        'requests': completed,
+        'errors': errors,
+        'status_codes': status_codes,
+        'throughput': completed / elapsed if elapsed > 0 else 0.0,
+        'bytes_received': sum(part['bytes_received'] for part in parts),
+        'latency_ms': {key: round(value, 3) for key, value in latency_ms.items()}
+    }
+
+def parse_path_mix(spec):
+    """Parse "/:3,/index.html:1" into [('/', 3.0), ('/index.html', 1.0)]."""
+    path_mix = []
+    for item in spec.split(','):
+        path, _, weight = item.partition(':')
+        path_mix.append((path, float(weight) if weight else 1.0))
+    return path_mix
 
+async def _burst(host, port, path, num_clients, sequential):
     results = []
-    threads = []
     
+    async def one(client_id):
+        start_time = time.perf_counter()
+        connection = LoadConnection(host, port, keep_alive=False, timeout=10)
+        try:
+            status_code, _ = await connection.request(path)
+            result = {'status_code': status_code, 'success': status_code == 200}
+        except (OSError, asyncio.TimeoutError, ResponseError, ValueError) as e:
+            result = {'status_code': 0, 'success': False, 'error': str(e)}
+        result['client_id'] = client_id
+        result['elapsed'] = time.perf_counter() - start_time
+        results.append(result)
+    
+    if sequential:
+        for i in range(num_clients):
+            await one(i + 1)
+    else:
+        await asyncio.gather(*(one(i + 1) for i in range(num_clients)))
+    
+    results.sort(key=lambda r: r['client_id'])
+    return results
+
+def test_concurrent_requests(host, port, num_clients, path='/'):
     print(f"   Starting {num_clients} concurrent requests to {host}:{port}")
     print(f"   Path: {path}")
     print(f"   Time: {datetime.now().strftime('%H:%M:%S.%f')[:-3]}\n")
     
     start_time = time.time()
-    
-    for i in range(num_clients):
-        thread = threading.Thread(
-            target=make_request,
-            args=(i + 1, host, port, path, results),
-            daemon=True
-        )
-        threads.append(thread)
-        thread.start()
-    
-    for thread in threads:
-        thread.join()
-    
+    results = asyncio.run(_burst(host, port, path, num_clients, sequential=False))
     total_time = time.time() - start_time
     
     return {
@@ -85,18 +331,12 @@ def test_concurrent_requests(host, port, num_clients, path='/'):
     }
 
 def test_sequential_requests(host, port, num_requests, path='/'):
-
-    results = []
-    
     print(f"   Starting {num_requests} sequential requests to {host}:{port}")
     print(f"   Path: {path}")
     print(f"   Time: {datetime.now().strftime('%H:%M:%S.%f')[:-3]}\n")
     
     start_time = time.time()
-    
-    for i in range(num_requests):
-        make_request(i + 1, host, port, path, results)
-    
+    results = asyncio.run(_burst(host, port, path, num_requests, sequential=True))
     total_time = time.time() - start_time
     
     return {
@@ -174,41 +414,33 @@ def compare_results(single_results, multi_results):
     print()
 
 def test_rate_limiting(host, port, requests_per_second, duration=5):
-
+    
     print(f"\n Rate Limiting Test")
     print(f"   Target: {requests_per_second} requests/second")
     print(f"   Duration: {duration} seconds")
     print(f"   Expected total: {requests_per_second * duration} requests\n")
     
-    results = []
-    start_time = time.time()
-    request_count = 0
+    summary = run_load(host, port, [('/', 1.0)], connections=requests_per_second,
+                       duration=duration, warmup=0, rate=requests_per_second,
+                       keep_alive=False)
     
-    while time.time() - start_time < duration:
-        delay = 1.0 / requests_per_second
-        
-        make_request(request_count + 1, host, port, '/', results)
-        request_count += 1
-        
-        time.sleep(delay)
-    
-    total_time = time.time() - start_time
-    successful = sum(1 for r in results if r['success'])
-    blocked = len(results) - successful
+    total_time = summary['elapsed']
+    total = summary['requests']
+    successful = summary['status_codes'].get('200', 0)
+    blocked = summary['status_codes'].get('429', 0)
     
     print(f"\n Rate Limiting Results:")
-    print(f"   Total requests: {len(results)}")
+    print(f"   Total requests: {total}")
     print(f"   Successful (200): {successful}")
     print(f"   Blocked (429): {blocked}")
-    print(f"   Actual rate: {len(results) / total_time:.2f} req/s")
+    print(f"   Actual rate: {total / total_time:.2f} req/s")
     print(f"   Success rate: {successful / total_time:.2f} req/s")
     
     return {
-        'total_requests': len(results),
+        'total_requests': total,
         'successful': successful,
         'blocked': blocked,
-        'total_time': total_time,
-        'results': results
+        'total_time': total_time
     }
 
 def check_server(host, port):
@@ -221,70 +453,147 @@ def check_server(host, port):
     except:
         return False
 
+def print_usage():
+    print("Usage: python3 benchmark_lab2.py [test_type] [options]")
+    print("\nTest Types:")
+    print("  comparison     - Compare single vs multithreaded (default)")
+    print("  concurrent     - Test concurrent requests only")
+    print("  rate-limit     - Test rate limiting")
+    print("  load           - Sustained load test, prints JSON results")
+    print("\nOptions:")
+    print("  --host HOST          Server host (default: localhost)")
+    print("  --port N             Server port (default: 8080)")
+    print("  --multi-port N       comparison: multithreaded server port, skips the prompts")
+    print("  --connections N      load: concurrent connections (default: 32)")
+    print("  --duration S         load: measured duration in seconds (default: 10)")
+    print("  --warmup S           load: unmeasured warm-up in seconds (default: 2)")
+    print("  --rate R             load: open loop at R requests/second (default: closed loop)")
+    print("  --paths SPEC         load: weighted path mix, e.g. /:3,/index.html:1 (default: /)")
+    print("  --no-keep-alive      load: open a new connection for every request")
+    print("  --processes N        load: split the load across N processes (default: 1)")
+    print("  --output FILE        load: also write the JSON results to FILE")
+    print("\nExamples:")
+    print("  python3 benchmark_lab2.py")
+    print("  python3 benchmark_lab2.py concurrent 50")
+    print("  python3 benchmark_lab2.py rate-limit")
+    print("  python3 benchmark_lab2.py load --connections 64 --duration 30")
+    print("  python3 benchmark_lab2.py load --rate 2000 --paths /:1,/index.html:4 --processes 4")
+
 def main():
-    print("""Lab 2: Performance Testing & Comparison Tool""")
-    
     host = 'localhost'
     port = 8080
-    
-    if len(sys.argv) > 1:
-        if sys.argv[1] == '--help':
-            print("Usage: python3 benchmark_lab2.py [test_type]")
-            print("\nTest Types:")
-            print("  comparison     - Compare single vs multithreaded (default)")
-            print("  concurrent     - Test concurrent requests only")
-            print("  rate-limit     - Test rate limiting")
-            print("\nExamples:")
-            print("  python3 benchmark_lab2.py")
-            print("  python3 benchmark_lab2.py concurrent")
-            print("  python3 benchmark_lab2.py rate-limit")
+    multi_port = None
+    connections = 32
+    duration = 10
+    warmup = 2
+    rate = None
+    path_mix = [('/', 1.0)]
+    keep_alive = True
+    processes = 1
+    output = None
+    positional = []
+    
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '--help':
+            print_usage()
             sys.exit(0)
+        elif sys.argv[i] == '--host' and i + 1 < len(sys.argv):
+            host = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--port' and i + 1 < len(sys.argv):
+            port = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--multi-port' and i + 1 < len(sys.argv):
+            multi_port = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--connections' and i + 1 < len(sys.argv):
+            connections = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--duration' and i + 1 < len(sys.argv):
+            duration = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--warmup' and i + 1 < len(sys.argv):
+            warmup = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--rate' and i + 1 < len(sys.argv):
+            rate = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--paths' and i + 1 < len(sys.argv):
+            path_mix = parse_path_mix(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--no-keep-alive':
+            keep_alive = False
+            i += 1
+        elif sys.argv[i] == '--processes' and i + 1 < len(sys.argv):
+            processes = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--output' and i + 1 < len(sys.argv):
+            output = sys.argv[i + 1]
+            i += 2
+        else:
+            positional.append(sys.argv[i])
+            i += 1
+    
+    test_type = positional[0] if positional else 'comparison'
     
-    # Check if server is running
-    print(f" Checking server at {host}:{port}...")
     if not check_server(host, port):
-        print(f"\n ERROR: Server is not running on {host}:{port}")
-        print(f"\nPlease start the server first:")
-        print(f"  Single-threaded (lab1): python3 file_server.py content/")
-        print(f"  Multithreaded (lab2):   python3 file_server_lab2.py content/ --delay 1")
+        print(f"\n ERROR: Server is not running on {host}:{port}", file=sys.stderr)
+        print(f"\nPlease start the server first:", file=sys.stderr)
+        print(f"  Single-threaded (lab1): python3 file_server.py content/", file=sys.stderr)
+        print(f"  Multithreaded (lab2):   python3 file_server_lab2.py content/ --delay 1",
+              file=sys.stderr)
         sys.exit(1)
     
-    print(f" Server is running!\n")
+    if test_type == 'load':
+        # Only JSON goes to stdout so the output can be piped straight
+        # into other tools.
+        summary = run_load(host, port, path_mix, connections=connections, duration=duration,
+                           warmup=warmup, rate=rate, keep_alive=keep_alive,
+                           processes=processes)
+        text = json.dumps(summary, indent=2)
+        print(text)
+        if output:
+            with open(output, 'w') as f:
+                f.write(text + "\n")
+        return
     
-    test_type = sys.argv[1] if len(sys.argv) > 1 else 'comparison'
+    print("""Lab 2: Performance Testing & Comparison Tool""")
+    print(f" Server is running at {host}:{port}\n")
     
     if test_type == 'comparison':
         # Full comparison test
         print("TEST 1: Single-threaded Server (Sequential Requests)")
-        print("\n  Make sure you're running the SINGLE-THREADED server:")
-        print("   python3 file_server.py content/\n")
-        
-        input("Press Enter when ready to test single-threaded server...")
+        if multi_port is None:
+            print("\n  Make sure you're running the SINGLE-THREADED server:")
+            print("   python3 file_server.py content/\n")
+            
+            input("Press Enter when ready to test single-threaded server...")
         
         single_results = test_sequential_requests(host, port, 10, '/')
         print_results("Single-threaded Server (10 Sequential Requests)", single_results)
         
         print("\n")
         print("TEST 2: Multithreaded Server (Concurrent Requests)")
-        print("\n  Now switch to the MULTITHREADED server with delay:")
-        print("   python3 file_server_lab2.py content/ --delay 1\n")
-        
-        input("Press Enter when ready to test multithreaded server...")
+        if multi_port is None:
+            print("\n  Now switch to the MULTITHREADED server with delay:")
+            print("   python3 file_server_lab2.py content/ --delay 1\n")
+            
+            input("Press Enter when ready to test multithreaded server...")
         
-        multi_results = test_concurrent_requests(host, port, 10, '/')
+        multi_results = test_concurrent_requests(host, multi_port or port, 10, '/')
         print_results("Multithreaded Server (10 Concurrent Requests)", multi_results)
         
         compare_results(single_results, multi_results)
-        
+    
     elif test_type == 'concurrent':
-        num_clients = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+        num_clients = int(positional[1]) if len(positional) > 1 else 10
         results = test_concurrent_requests(host, port, num_clients, '/')
         print_results(f"Concurrent Test ({num_clients} clients)", results)
-        
+    
     elif test_type == 'rate-limit':
         print("  Make sure server is running with rate limiting:")
         print("   python3 file_server_lab2.py content/ --rate-limit 5\n")
-        input("Press Enter to start rate limiting test...")
         
         test_rate_limiting(host, port, requests_per_second=10, duration=5)
     
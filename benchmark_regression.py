@@ -0,0 +1,367 @@
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+from datetime import datetime
+
+from benchmark_lab2 import run_load
+
+# Server configurations: name -> (server, HTTPFileServer keyword arguments).
+# 'lab1' is the single-threaded file_server.py and takes no options.
+SERVER_CONFIGS = {
+    'lab1': ('lab1', {}),
+    'threads': ('lab2', {'num_threads': 8}),
+    'threads-elastic': ('lab2', {'num_threads': 4, 'max_threads': 32}),
+    'threads-no-locks': ('lab2', {'num_threads': 8, 'use_locks': False}),
+    'threads-rate-limit': ('lab2', {'num_threads': 8, 'enable_rate_limiting': True,
+                                    'rate_limit': 100}),
+    'threads-no-cache': ('lab2', {'num_threads': 8, 'cache_size': 0}),
+    'threads-mmap': ('lab2', {'num_threads': 8, 'use_mmap': True}),
+    'threads-preindex': ('lab2', {'num_threads': 8, 'preindex': True}),
+    'asyncio': ('lab2', {'engine': 'asyncio'})
+}
+
+# Workloads: name -> run_load keyword arguments. Paths refer to the
+# generated content tree (see generate_content).
+WORKLOADS = {
+    'small-files': {'paths': [('/small/page_{n}.html', 1.0)], 'connections': 16},
+    'mixed': {'paths': [('/small/page_{n}.html', 6.0), ('/small/notes_{n}.txt', 2.0),
+                        ('/', 1.0), ('/large/blob_{n}.pdf', 1.0)], 'connections': 16},
+    'listing': {'paths': [('/small/', 1.0)], 'connections': 8},
+    'open-loop': {'paths': [('/small/page_{n}.html', 1.0)], 'connections': 32,
+                  'rate': 500}
+}
+
+# Per-config overrides of the workload load settings. file_server.py
+# sleeps 1 s per request on a single thread, so under the shared settings
+# every queued connection times out and lab1 measures 0 req/s; it gets one
+# connection, an open-loop rate it can keep up with, and a longer window.
+CONFIG_LOAD = {
+    'lab1': {'connections': 1, 'rate': 0.5, 'timeout': 5, 'min_duration': 20}
+}
+
+DEFAULT_CONFIGS = ['threads', 'threads-elastic', 'asyncio']
+DEFAULT_WORKLOADS = ['small-files', 'mixed', 'listing', 'open-loop']
+
+# Rise in the error or non-2xx share, in percentage points, that counts as
+# a regression. Shares start near zero, so a relative threshold is useless.
+FAILURE_TOLERANCE = 0.5
+
+def generate_content(root, num_files=50, file_size=4 * 1024, num_large=2,
+                     large_size=4 * 1024 * 1024, seed=0):
+    """
+    Build a reproducible content tree under root.
+    
+    small/ holds num_files HTML pages and text files of about file_size
+    bytes; large/ holds num_large PDF-typed binary files of large_size bytes.
+    """
+    rng = random.Random(seed)
+    small_dir = os.path.join(root, 'small')
+    large_dir = os.path.join(root, 'large')
+    os.makedirs(small_dir, exist_ok=True)
+    os.makedirs(large_dir, exist_ok=True)
+    
+    words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'server', 'thread', 'socket']
+    for n in range(num_files):
+        text = ' '.join(rng.choice(words) for _ in range(file_size // 6 + 1))[:file_size]
+        with open(os.path.join(small_dir, f'page_{n}.html'), 'w') as f:
+            f.write(f"<html><body><p>{text}</p></body></html>")
+        with open(os.path.join(small_dir, f'notes_{n}.txt'), 'w') as f:
+            f.write(text)
+    
+    for n in range(num_large):
+        with open(os.path.join(large_dir, f'blob_{n}.pdf'), 'wb') as f:
+            f.write(rng.randbytes(large_size))
+    
+    with open(os.path.join(root, 'index.html'), 'w') as f:
+        f.write("<html><body><h1>Benchmark content</h1></body></html>")
+
+def expand_paths(paths, num_files, num_large):
+    """Turn '{n}' templates into one weighted entry per generated file."""
+    path_mix = []
+    for template, weight in paths:
+        if '{n}' not in template:
+            path_mix.append((template, weight))
+            continue
+        count = num_large if template.startswith('/large/') else num_files
+        for n in range(count):
+            path_mix.append((template.format(n=n), weight / count))
+    return path_mix
+
+def _serve_lab1(serve_directory, port_queue):
+    import file_server
+    
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind(('127.0.0.1', 0))
+    server_socket.listen(128)
+    port_queue.put(server_socket.getsockname()[1])
+    
+    while True:
+        client_socket, _ = server_socket.accept()
+        file_server.handle_request(client_socket, serve_directory)
+
+def _serve_lab2(serve_directory, server_kwargs, port_queue):
+    from file_server_lab2 import HTTPFileServer
+    
+    server = HTTPFileServer(serve_directory, host='127.0.0.1', port=0, **server_kwargs)
+    port_queue.put(server.port)
+    server.start()
+
+def _run_server(kind, serve_directory, server_kwargs, port_queue):
+    # Server output would drown the report and cost time writing to a
+    # terminal; the measurements come from the client side.
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+    
+    if kind == 'lab1':
+        _serve_lab1(serve_directory, port_queue)
+    else:
+        _serve_lab2(serve_directory, server_kwargs, port_queue)
+
+def run_config(name, serve_directory, workloads, num_files, num_large, duration, warmup):
+    """Start one server configuration in a child process and run each workload against it."""
+    kind, server_kwargs = SERVER_CONFIGS[name]
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_run_server,
+        args=(kind, serve_directory, server_kwargs, port_queue),
+        daemon=True
+    )
+    process.start()
+    
+    load = CONFIG_LOAD.get(name, {})
+    results = {}
+    try:
+        port = port_queue.get(timeout=10)
+        for workload in workloads:
+            spec = WORKLOADS[workload]
+            rate = spec.get('rate')
+            if rate is not None:
+                rate = load.get('rate', rate)
+            print(f"[Regression] {name} / {workload} ...", file=sys.stderr)
+            results[workload] = run_load(
+                '127.0.0.1', port,
+                expand_paths(spec['paths'], num_files, num_large),
+                connections=load.get('connections', spec['connections']),
+                rate=rate,
+                duration=max(duration, load.get('min_duration', 0)),
+                warmup=warmup,
+                timeout=load.get('timeout', 10)
+            )
+    finally:
+        process.terminate()
+        process.join(timeout=5)
+    return results
+
+def failure_shares(config, summary):
+    """
+    Returns:
+        (error_pct, non_2xx_pct): requests that got no response at all, as a
+        percentage of attempts, and responses outside 2xx as a percentage of
+        responses. 429 is expected from the rate-limited config and not counted.
+    """
+    expected = set()
+    if SERVER_CONFIGS.get(config, (None, {}))[1].get('enable_rate_limiting'):
+        expected.add('429')
+    
+    errors = sum(summary['errors'].values())
+    responses = sum(summary['status_codes'].values())
+    non_2xx = sum(count for code, count in summary['status_codes'].items()
+                  if not code.startswith('2') and code not in expected)
+    
+    attempts = responses + errors
+    error_pct = errors / attempts * 100 if attempts else 0.0
+    non_2xx_pct = non_2xx / responses * 100 if responses else 0.0
+    return error_pct, non_2xx_pct
+
+def compare_to_baseline(current, baseline, threshold):
+    """
+    Compare every config/workload pair present in both runs.
+    
+    Throughput and p99 latency regress when they get worse by more than
+    threshold percent. The error and non-2xx shares regress when they rise
+    by more than FAILURE_TOLERANCE percentage points, so a change that fails
+    requests quickly cannot pass as a throughput gain.
+    
+    Returns:
+        list of (config, workload, metric, baseline_value, current_value, change)
+        where change is in percent, or in percentage points for *_pct metrics
+    """
+    regressions = []
+    for config, workloads in current['results'].items():
+        for workload, summary in workloads.items():
+            before = baseline.get('results', {}).get(config, {}).get(workload)
+            if before is None:
+                continue
+            
+            checks = [
+                ('throughput', before['throughput'], summary['throughput'], -1),
+                ('p99_ms', before['latency_ms']['p99'], summary['latency_ms']['p99'], 1)
+            ]
+            for metric, old, new, worse_direction in checks:
+                if old <= 0:
+                    continue
+                change = (new - old) / old * 100
+                if change * worse_direction > threshold:
+                    regressions.append((config, workload, metric, old, new, change))
+            
+            shares = zip(('error_pct', 'non_2xx_pct'),
+                         failure_shares(config, before), failure_shares(config, summary))
+            for metric, old, new in shares:
+                if new - old > FAILURE_TOLERANCE:
+                    regressions.append((config, workload, metric, old, new, new - old))
+    return regressions
+
+def print_report(current, regressions, threshold):
+    print(f"\n[Regression] Results ({current['timestamp']}):")
+    print(f"  {'config':<20} {'workload':<12} {'req/s':>10} {'p50 ms':>9} "
+          f"{'p99 ms':>9} {'p99.9 ms':>9} {'errors':>7} {'non-2xx':>8}")
+    for config, workloads in current['results'].items():
+        for workload, summary in workloads.items():
+            latency = summary['latency_ms']
+            errors = sum(summary['errors'].values())
+            non_2xx_pct = failure_shares(config, summary)[1]
+            print(f"  {config:<20} {workload:<12} {summary['throughput']:>10.1f} "
+                  f"{latency['p50']:>9.2f} {latency['p99']:>9.2f} "
+                  f"{latency['p99.9']:>9.2f} {errors:>7} {non_2xx_pct:>7.1f}%")
+    
+    if regressions:
+        print(f"\n[Regression] {len(regressions)} regression(s):")
+        for config, workload, metric, old, new, change in regressions:
+            unit = ' pts' if metric.endswith('_pct') else '%'
+            print(f"  {config} / {workload}: {metric} {old:.2f} -> {new:.2f} "
+                  f"({change:+.1f}{unit})")
+    else:
+        print(f"\n[Regression] No regressions beyond {threshold:g}% "
+              f"(or {FAILURE_TOLERANCE:g} pts more failures)")
+
+def main():
+    configs = DEFAULT_CONFIGS
+    workloads = DEFAULT_WORKLOADS
+    num_files = 50
+    file_size = 4 * 1024
+    num_large = 2
+    large_size = 4 * 1024 * 1024
+    duration = 5
+    warmup = 1
+    output = 'benchmark_results.json'
+    baseline_path = None
+    save_baseline = None
+    threshold = 10.0
+    
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '--help':
+            print("Usage: python3 benchmark_regression.py [options]")
+            print("\nOptions:")
+            print(f"  --configs A,B        Server configs to run (default: {','.join(DEFAULT_CONFIGS)})")
+            print(f"                       Available: {','.join(SERVER_CONFIGS)}")
+            print(f"  --workloads A,B      Workloads to run (default: {','.join(DEFAULT_WORKLOADS)})")
+            print("  --files N            Small files to generate (default: 50)")
+            print("  --file-size KB       Size of each small file (default: 4)")
+            print("  --large-files N      Large files to generate (default: 2)")
+            print("  --large-size MB      Size of each large file (default: 4)")
+            print("  --duration S         Measured seconds per workload (default: 5)")
+            print("  --warmup S           Warm-up seconds per workload (default: 1)")
+            print("  --output FILE        Where to write results (default: benchmark_results.json)")
+            print("  --baseline FILE      Compare against a saved baseline")
+            print("  --save-baseline FILE Also save these results as a new baseline")
+            print("  --threshold PCT      Regression threshold in percent (default: 10)")
+            print("\nExit status is 1 when a regression beyond the threshold is found.")
+            sys.exit(0)
+        elif sys.argv[i] == '--configs' and i + 1 < len(sys.argv):
+            configs = sys.argv[i + 1].split(',')
+            i += 2
+        elif sys.argv[i] == '--workloads' and i + 1 < len(sys.argv):
+            workloads = sys.argv[i + 1].split(',')
+            i += 2
+        elif sys.argv[i] == '--files' and i + 1 < len(sys.argv):
+            num_files = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--file-size' and i + 1 < len(sys.argv):
+            file_size = int(float(sys.argv[i + 1]) * 1024)
+            i += 2
+        elif sys.argv[i] == '--large-files' and i + 1 < len(sys.argv):
+            num_large = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--large-size' and i + 1 < len(sys.argv):
+            large_size = int(float(sys.argv[i + 1]) * 1024 * 1024)
+            i += 2
+        elif sys.argv[i] == '--duration' and i + 1 < len(sys.argv):
+            duration = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--warmup' and i + 1 < len(sys.argv):
+            warmup = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--output' and i + 1 < len(sys.argv):
+            output = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--baseline' and i + 1 < len(sys.argv):
+            baseline_path = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--save-baseline' and i + 1 < len(sys.argv):
+            save_baseline = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--threshold' and i + 1 < len(sys.argv):
+            threshold = float(sys.argv[i + 1])
+            i += 2
+        else:
+            i += 1
+    
+    for name in configs:
+        if name not in SERVER_CONFIGS:
+            print(f"Error: unknown config '{name}' (available: {', '.join(SERVER_CONFIGS)})")
+            sys.exit(1)
+    for name in workloads:
+        if name not in WORKLOADS:
+            print(f"Error: unknown workload '{name}' (available: {', '.join(WORKLOADS)})")
+            sys.exit(1)
+    
+    content_root = tempfile.mkdtemp(prefix='bench-content-')
+    try:
+        generate_content(content_root, num_files, file_size, num_large, large_size)
+        
+        current = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'content': {
+                'files': num_files,
+                'file_size': file_size,
+                'large_files': num_large,
+                'large_size': large_size
+            },
+            'duration': duration,
+            'warmup': warmup,
+            'results': {}
+        }
+        for name in configs:
+            current['results'][name] = run_config(name, content_root, workloads,
+                                                  num_files, num_large, duration, warmup)
+    finally:
+        shutil.rmtree(content_root, ignore_errors=True)
+    
+    with open(output, 'w') as f:
+        json.dump(current, f, indent=2)
+    print(f"[Regression] Results written to {output}")
+    if save_baseline:
+        with open(save_baseline, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f"[Regression] Baseline saved to {save_baseline}")
+    
+    regressions = []
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(current, baseline, threshold)
+    print_report(current, regressions, threshold)
+    
+    if regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
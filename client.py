@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
 
+import codecs
 import socket
 import sys
 import os
 import urllib.parse
 
+RECV_BUFFER_SIZE = 64 * 1024
+MAX_HEADER_SIZE = 64 * 1024
+
 def main():
     if len(sys.argv) != 5:
         print("Usage: python client.py server_host server_port url_path save_directory")
@@ -20,88 +24,178 @@ def main():
     
     make_request(server_host, server_port, url_path, save_directory)
 
+class SocketReader:
+    """
+    Reads from a socket through one reusable buffer filled with recv_into,
+    so memory use stays fixed no matter how large the response is.
+    """
+    
+    def __init__(self, sock, buffer_size=RECV_BUFFER_SIZE):
+        self.sock = sock
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+    
+    def _fill(self):
+        """Read more data into the buffer. Returns False at end of stream."""
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buffer):
+            # Slide unread bytes to the front to make room.
+            remaining = self.end - self.start
+            self.buffer[:remaining] = self.buffer[self.start:self.end]
+            self.start, self.end = 0, remaining
+        
+        received = self.sock.recv_into(self.view[self.end:])
+        self.end += received
+        return received > 0
+    
+    def read_until(self, delimiter, limit):
+        """Return bytes up to and including delimiter, or None if the stream ends first."""
+        while True:
+            index = self.buffer.find(delimiter, self.start, self.end)
+            if index != -1:
+                data = bytes(self.buffer[self.start:index + len(delimiter)])
+                self.start = index + len(delimiter)
+                return data
+            if self.end - self.start >= limit:
+                raise ValueError("Response header too large")
+            if not self._fill():
+                return None
+    
+    def copy_to(self, write, count=None):
+        """
+        Pass count bytes (or everything until the server closes) to write,
+        one buffer-sized piece at a time.
+        
+        Returns:
+            number of bytes written
+        """
+        written = 0
+        while count is None or written < count:
+            if self.start == self.end and not self._fill():
+                break
+            available = self.end - self.start
+            if count is not None:
+                available = min(available, count - written)
+            write(self.view[self.start:self.start + available])
+            self.start += available
+            written += available
+        return written
+    
+    def copy_chunked_to(self, write):
+        """Decode a chunked body, passing its data to write. Returns bytes written."""
+        written = 0
+        while True:
+            size_line = self.read_until(b"\r\n", MAX_HEADER_SIZE)
+            if size_line is None:
+                break
+            size = int(size_line.split(b';')[0], 16)
+            if size == 0:
+                self.read_until(b"\r\n", MAX_HEADER_SIZE)
+                break
+            written += self.copy_to(write, size)
+            self.read_until(b"\r\n", MAX_HEADER_SIZE)
+        return written
+
 def make_request(server_host, server_port, url_path, save_directory):
     try:
         client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         client_socket.connect((server_host, server_port))
         
         request = f"GET {url_path} HTTP/1.1\r\nHost: {server_host}:{server_port}\r\nConnection: close\r\n\r\n"
-        client_socket.send(request.encode('utf-8'))
-        
-        response_data = b""
-        while True:
-            chunk = client_socket.recv(4096)
-            if not chunk:
-                break
-            response_data += chunk
-        
-        client_socket.close()
-        
-        parse_response(response_data, url_path, save_directory)
+        client_socket.sendall(request.encode('utf-8'))
         
+        with client_socket:
+            parse_response(SocketReader(client_socket), url_path, save_directory)
+    
     except Exception as e:
         print(f"Error making request: {e}")
 
-def parse_response(response_data, url_path, save_directory):
+def read_headers(reader):
+    """
+    Read the status line and headers, leaving the body in the reader.
+    
+    Returns:
+        (status_line, headers) with header names lowercased, or None
+    """
+    head = reader.read_until(b"\r\n\r\n", MAX_HEADER_SIZE)
+    if head is None:
+        return None
+    
+    header_lines = head.decode('iso-8859-1').split('\r\n')
+    headers = {}
+    for line in header_lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    return header_lines[0], headers
+
+def read_body(reader, headers, write):
+    """Stream the body to write, honoring Content-Length or chunked encoding."""
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        return reader.copy_chunked_to(write), None
+    
+    content_length = headers.get('content-length')
+    if content_length is not None:
+        content_length = int(content_length)
+    return reader.copy_to(write, content_length), content_length
+
+def print_text_body(reader, headers):
+    # Decode piece by piece; the incremental decoder keeps multi-byte
+    # characters that straddle two pieces intact.
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    read_body(reader, headers, lambda data: sys.stdout.write(decoder.decode(data)))
+    sys.stdout.write(decoder.decode(b"", final=True))
+    print()
+
+def parse_response(reader, url_path, save_directory):
     try:
-        response_str = response_data.decode('utf-8', errors='ignore')
-        
-        header_end = response_str.find('\r\n\r\n')
-        if header_end == -1:
+        parsed = read_headers(reader)
+        if parsed is None:
             print("Invalid HTTP response")
             return
         
-        headers = response_str[:header_end]
-        body_start = header_end + 4
-        
-        header_lines = headers.split('\r\n')
-        status_line = header_lines[0]
+        status_line, headers = parsed
         print(f"Status: {status_line}")
         
         status_parts = status_line.split(' ', 2)
         if len(status_parts) < 2:
             print("Invalid status line")
             return
-            
+        
         status_code = int(status_parts[1])
         if status_code != 200:
             print(f"Error: HTTP {status_code}")
-            body = response_str[body_start:]
-            print(body)
+            print_text_body(reader, headers)
             return
         
-        content_type = "text/html"
-        for line in header_lines[1:]:
-            if line.lower().startswith('content-type:'):
-                content_type = line.split(':', 1)[1].strip()
-                break
+        content_type = headers.get('content-type', 'text/html')
         
         print(f"Content-Type: {content_type}")
         
         if content_type.startswith('text/html'):
-            body = response_str[body_start:]
             print("HTML Content:")
-            print(body)
-            
+            print_text_body(reader, headers)
+        
         elif content_type == 'image/png' or content_type == 'application/pdf':
-            body_bytes = response_data[body_start:]
-            filename = os.path.basename(url_path) or "downloaded_file"
-            if not filename:
-                filename = "index.html" if content_type == "text/html" else "file"
-                
+            filename = os.path.basename(urllib.parse.urlparse(url_path).path) or "downloaded_file"
             filepath = os.path.join(save_directory, filename)
             
             with open(filepath, 'wb') as f:
-                f.write(body_bytes)
+                written, expected = read_body(reader, headers, f.write)
             
             print(f"File saved to: {filepath}")
             print(f"File type: {content_type}")
-            print(f"File size: {len(body_bytes)} bytes")
-            
+            print(f"File size: {written} bytes")
+            if expected is not None and written != expected:
+                print(f"Warning: connection closed after {written} of {expected} bytes")
+        
         else:
             print(f"Unsupported file type: {content_type}")
             print("Server only supports HTML, PNG, and PDF files.")
-        
+    
     except Exception as e:
         print(f"Error parsing response: {e}")
 
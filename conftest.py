@@ -0,0 +1,15 @@
+import pytest
+
+from file_server_lab2 import HTTPFileServer
+
+# test_race.py is a script run by hand against a live server on port 8080,
+# not a pytest module; importing it would try to connect and exit.
+collect_ignore = ['test_race.py']
+
+@pytest.fixture(scope='module')
+def server(tmp_path_factory):
+    """An HTTPFileServer bound to an ephemeral port but not accepting yet."""
+    server = HTTPFileServer(str(tmp_path_factory.mktemp('serve')), host='127.0.0.1', port=0,
+                            access_log_format='off')
+    yield server
+    server.shutdown()
@@ -1,287 +1,2436 @@
 
 
+import asyncio
+import bisect
+import gzip
+import json
+import mmap
+import multiprocessing
+import queue
+import random
+import select
+import selectors
+import signal
 import socket
+import stat
 import sys
 import os
 import threading
 import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from queue import Queue
+from urllib.parse import parse_qs
 from pathlib import Path
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
 from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+FILE_CHUNK_SIZE = 64 * 1024
+MAX_RANGES = 16
+MAX_COMPRESS_SIZE = 1024 * 1024
+KEEP_ALIVE_GRACE = 0.002
+
+STATUS_TEXTS = {
+    200: "OK",
+    206: "Partial Content",
+    304: "Not Modified",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    416: "Range Not Satisfiable",
+    429: "Too Many Requests",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable"
+}
+
+# Encoded once; every response starts with one of these.
+STATUS_LINES = {
+    code: f"HTTP/1.1 {code} {text}\r\n".encode('latin-1')
+    for code, text in STATUS_TEXTS.items()
+}
+
+# Text files are sent as stored, byte for byte, so their charset is
+# declared rather than discovered by decoding them.
+TEXT_CHARSET = 'utf-8'
+HTML_CONTENT_TYPE = f'text/html; charset={TEXT_CHARSET}'
+
+MIME_TYPES = {
+    '.html': HTML_CONTENT_TYPE,
+    '.htm': HTML_CONTENT_TYPE,
+    '.png': 'image/png',
+    '.pdf': 'application/pdf',
+    '.txt': f'text/plain; charset={TEXT_CHARSET}'
+}
 
 class ThreadPool:
+    """
+    Elastic worker pool.
     
-    def __init__(self, num_threads=4):
+    Keeps at least num_threads workers and grows up to max_threads when
+    tasks queue up with no idle worker or wait longer than scale_up_wait.
+    Workers above the minimum retire after idle_timeout seconds without work.
+    """
+    
+    def __init__(self, num_threads=4, max_queue_size=0, max_threads=None,
+                 idle_timeout=30, scale_up_wait=0.05, log=print):
         self.num_threads = num_threads
-        self.task_queue = Queue()
+        self.log = log
+        self.max_threads = max(num_threads, max_threads or num_threads)
+        self.idle_timeout = idle_timeout
+        self.scale_up_wait = scale_up_wait
+        self.task_queue = Queue(maxsize=max_queue_size)
         self.threads = []
         self.is_running = True
         
+        self.pool_lock = threading.Lock()
+        self.live_workers = 0
+        self.idle_workers = 0
+        self.next_worker_id = 0
+        self.workers_spawned = 0
+        self.workers_retired = 0
+        
         self.tasks_completed = 0
+        self.total_queue_wait = 0.0
+        self.max_queue_wait = 0.0
         self.tasks_lock = threading.Lock()
+        self.queue_wait_histogram = LatencyHistogram()
         
-        print(f"[ThreadPool] Creating pool with {num_threads} workers")
+        if self.max_threads > num_threads:
+            print(f"[ThreadPool] Creating pool with {num_threads}-{self.max_threads} workers")
+        else:
+            print(f"[ThreadPool] Creating pool with {num_threads} workers")
+        
+        with self.pool_lock:
+            for _ in range(num_threads):
+                self._spawn_worker()
+    
+    def _spawn_worker(self):
+        # Caller holds pool_lock.
+        worker_id = self.next_worker_id
+        self.next_worker_id += 1
+        self.live_workers += 1
+        self.workers_spawned += 1
         
-        for i in range(num_threads):
-            thread = threading.Thread(target=self._worker, args=(i,), daemon=True)
-            thread.start()
-            self.threads.append(thread)
+        thread = threading.Thread(target=self._worker, args=(worker_id,), daemon=True)
+        self.threads.append(thread)
+        thread.start()
+    
+    def _maybe_grow(self):
+        with self.pool_lock:
+            if self.is_running and self.live_workers < self.max_threads:
+                self._spawn_worker()
     
     def _worker(self, worker_id):
-        while self.is_running:
+        while True:
+            with self.pool_lock:
+                self.idle_workers += 1
+                may_retire = self.live_workers > self.num_threads
+            
             try:
-                task = self.task_queue.get(timeout=1)
-                
-                if task is None: 
-                    break
-                
-                func, args = task
-                
-                try:
-                    func(*args)
-                    with self.tasks_lock:
-                        self.tasks_completed += 1
-                except Exception as e:
-                    print(f"[Worker-{worker_id}] Error: {e}")
-                finally:
-                    self.task_queue.task_done()
-                    
-            except:
+                # Workers at the minimum block indefinitely; extra workers
+                # wait only as long as they are allowed to stay idle.
+                if may_retire:
+                    task = self.task_queue.get(timeout=self.idle_timeout)
+                else:
+                    task = self.task_queue.get()
+            except queue.Empty:
+                with self.pool_lock:
+                    self.idle_workers -= 1
+                    retiring = self.live_workers > self.num_threads
+                    if retiring:
+                        self._retire(worker_id)
+                if retiring:
+                    release_thread_shards()
+                    return
                 continue
+            
+            with self.pool_lock:
+                self.idle_workers -= 1
+            
+            if task is None:
+                self.task_queue.task_done()
+                with self.pool_lock:
+                    self._retire(worker_id)
+                release_thread_shards()
+                return
+            
+            func, args, enqueued_at = task
+            queue_wait = time.monotonic() - enqueued_at
+            self.queue_wait_histogram.observe((), queue_wait)
+            if queue_wait > self.scale_up_wait and not self.task_queue.empty():
+                self._maybe_grow()
+            
+            try:
+                func(*args)
+                with self.tasks_lock:
+                    self.tasks_completed += 1
+                    self.total_queue_wait += queue_wait
+                    self.max_queue_wait = max(self.max_queue_wait, queue_wait)
+            except Exception as e:
+                self.log(f"[Worker-{worker_id}] Error: {e}")
+            finally:
+                self.task_queue.task_done()
+    
+    def _retire(self, worker_id):
+        # Caller holds pool_lock.
+        self.live_workers -= 1
+        self.workers_retired += 1
+        current = threading.current_thread()
+        if current in self.threads:
+            self.threads.remove(current)
     
     def submit(self, func, *args):
-        self.task_queue.put((func, args))
+        """
+        Queue a task without blocking.
+        
+        Returns:
+            False if the queue is full and the task was rejected
+        """
+        try:
+            self.task_queue.put_nowait((func, args, time.monotonic()))
+        except queue.Full:
+            return False
+        
+        if self.idle_workers == 0 and self.live_workers < self.max_threads:
+            self._maybe_grow()
+        return True
     
     def get_queue_size(self):
         return self.task_queue.qsize()
     
+    def get_statistics(self):
+        with self.pool_lock:
+            pool = {
+                'workers': self.live_workers,
+                'idle_workers': self.idle_workers,
+                'min_workers': self.num_threads,
+                'max_workers': self.max_threads,
+                'workers_spawned': self.workers_spawned,
+                'workers_retired': self.workers_retired
+            }
+        with self.tasks_lock:
+            completed = self.tasks_completed
+            pool['tasks_completed'] = completed
+            pool['avg_queue_wait'] = self.total_queue_wait / completed if completed else 0.0
+            pool['max_queue_wait'] = self.max_queue_wait
+        pool['queue_size'] = self.get_queue_size()
+        return pool
+    
     def shutdown(self):
         print("\n[ThreadPool] Shutting down...")
-        self.is_running = False
         
-        for _ in range(self.num_threads):
-            self.task_queue.put(None)
+        with self.pool_lock:
+            self.is_running = False
+            threads = list(self.threads)
         
-        for thread in self.threads:
+        for _ in threads:
+            try:
+                self.task_queue.put(None, timeout=0.5)
+            except queue.Full:
+                break
+        
+        for thread in threads:
             thread.join(timeout=2)
         
         print(f"[ThreadPool] Shutdown complete. Total tasks: {self.tasks_completed}")
 
+class IdleConnections:
+    """
+    Holds keep-alive connections between requests.
+    
+    One thread waits on every parked socket with a selector, so an idle
+    client costs a file descriptor rather than a pool worker blocked in
+    recv. A connection that turns readable is handed to resume; one that
+    stays idle for idle_timeout seconds is closed.
+    """
+    
+    POLL_INTERVAL = 0.25
+    
+    def __init__(self, resume, idle_timeout, log=print):
+        self.resume = resume
+        self.idle_timeout = idle_timeout
+        self.log = log
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.is_running = True
+        
+        self.parked = 0
+        self.resumed = 0
+        self.expired = 0
+        
+        self.thread = threading.Thread(target=self._poll_loop, name="IdleConnections",
+                                       daemon=True)
+        self.thread.start()
+    
+    def park(self, connection, client_ip):
+        deadline = time.monotonic() + self.idle_timeout
+        with self.lock:
+            if self.is_running:
+                try:
+                    self.selector.register(connection.sock, selectors.EVENT_READ,
+                                           (connection, client_ip, deadline))
+                    self.parked += 1
+                    return
+                except (OSError, ValueError, KeyError):
+                    pass
+        connection.sock.close()
+    
+    def _poll_loop(self):
+        next_sweep = time.monotonic() + self.POLL_INTERVAL
+        while self.is_running:
+            try:
+                events = self.selector.select(timeout=self.POLL_INTERVAL)
+            except OSError as e:
+                if self.is_running:
+                    self.log(f"[IdleConnections] Poll failed: {e}")
+                continue
+            
+            for key, _ in events:
+                if not self._unregister(key.fileobj):
+                    continue
+                connection, client_ip, _ = key.data
+                with self.lock:
+                    self.resumed += 1
+                try:
+                    self.resume(connection, client_ip)
+                except Exception as e:
+                    self.log(f"[IdleConnections] Error resuming connection: {e}")
+                    connection.sock.close()
+            
+            now = time.monotonic()
+            if now >= next_sweep:
+                self._close_expired(now)
+                next_sweep = now + self.POLL_INTERVAL
+    
+    def _unregister(self, sock):
+        with self.lock:
+            try:
+                self.selector.unregister(sock)
+                return True
+            except (KeyError, ValueError):
+                return False
+    
+    def _close_expired(self, now):
+        with self.lock:
+            keys = list(self.selector.get_map().values())
+        for key in keys:
+            if key.data[2] <= now and self._unregister(key.fileobj):
+                key.fileobj.close()
+                with self.lock:
+                    self.expired += 1
+    
+    def get_statistics(self):
+        with self.lock:
+            parked_now = self.selector.get_map()
+            return {
+                'idle': len(parked_now) if parked_now is not None else 0,
+                'parked': self.parked,
+                'resumed': self.resumed,
+                'expired': self.expired
+            }
+    
+    def close(self):
+        with self.lock:
+            self.is_running = False
+        self.thread.join(timeout=2)
+        with self.lock:
+            for key in list(self.selector.get_map().values()):
+                key.fileobj.close()
+            self.selector.close()
+
+class RequestError(Exception):
+    """A request that cannot be parsed; answered with status_code and closed."""
+    
+    def __init__(self, status_code, status_text):
+        super().__init__(status_text)
+        self.status_code = status_code
+        self.status_text = status_text
+
+class HTTPRequest:
+    
+    def __init__(self, method, path, version, headers):
+        self.method = method
+        self.path = path
+        self.version = version
+        self.headers = headers
+        self.received_at = time.perf_counter()
+        self.parse_time = 0.0
+        self.handler_time = 0.0
+        self.send_time = 0.0
+        self.route = 'file'
+        self.status = None
+        self.bytes_sent = 0
+
+class RequestParser:
+    """
+    Incremental HTTP/1.x request parser.
+    
+    Bytes are fed in as they arrive; next_request() returns a request once
+    its head (and any Content-Length body) is complete and keeps whatever
+    follows in the buffer for the next pipelined request.
+    """
+    
+    def __init__(self, max_header_size=8192, max_body_size=1024 * 1024):
+        self.buffer = bytearray()
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+    
+    def feed(self, data):
+        self.buffer += data
+    
+    def next_request(self):
+        parse_start = time.perf_counter()
+        request = self._next_request()
+        if request is not None:
+            request.parse_time = time.perf_counter() - parse_start
+        return request
+    
+    def _next_request(self):
+        head_end, separator_length = self._find_head_end()
+        if head_end == -1:
+            if len(self.buffer) > self.max_header_size:
+                raise RequestError(431, "Request Header Fields Too Large")
+            return None
+        if head_end > self.max_header_size:
+            raise RequestError(431, "Request Header Fields Too Large")
+        
+        head = self.buffer[:head_end].decode('iso-8859-1')
+        lines = head.split('\n')
+        method, path, version = self._parse_request_line(lines[0].strip())
+        headers = self._parse_headers(lines[1:])
+        
+        if 'transfer-encoding' in headers:
+            raise RequestError(411, "Length Required")
+        try:
+            body_length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise RequestError(400, "Bad Request")
+        if body_length < 0:
+            raise RequestError(400, "Bad Request")
+        if body_length > self.max_body_size:
+            raise RequestError(413, "Payload Too Large")
+        
+        request_end = head_end + separator_length + body_length
+        if len(self.buffer) < request_end:
+            return None
+        del self.buffer[:request_end]
+        
+        return HTTPRequest(method, path, version, headers)
+    
+    def _find_head_end(self):
+        crlf = self.buffer.find(b'\r\n\r\n')
+        lf = self.buffer.find(b'\n\n')
+        if lf != -1 and (crlf == -1 or lf < crlf):
+            return lf, 2
+        return crlf, 4
+    
+    def _parse_request_line(self, request_line):
+        parts = request_line.split(' ')
+        if len(parts) == 2:
+            parts.append('HTTP/1.0')
+        if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+            raise RequestError(400, "Bad Request")
+        
+        method, path, version = parts
+        try:
+            path = path.encode('iso-8859-1').decode('utf-8')
+        except UnicodeDecodeError:
+            raise RequestError(400, "Bad Request")
+        return method, path, version
+    
+    def _parse_headers(self, header_lines):
+        headers = {}
+        for line in header_lines:
+            line = line.strip()
+            if not line:
+                break
+            if ':' not in line:
+                raise RequestError(400, "Bad Request")
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+        return headers
+
+def _set_nodelay(sock):
+    """
+    Disable Nagle's algorithm. Responses are written as a head followed by
+    a body, and Nagle would hold the second write until the client's
+    delayed ACK (about 40 ms) on a kept-alive connection.
+    """
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except (OSError, AttributeError):
+        pass
+
+def _note_response_bytes(connection, data, sent=None):
+    """Track bytes written and pick the status code off the response line."""
+    if connection.status is None and data[:9] == b'HTTP/1.1 ':
+        connection.status = int(data[9:12])
+    connection.bytes_sent += len(data) if sent is None else sent
+
+class ClientConnection:
+    """Socket wrapper that carries per-connection HTTP state."""
+    
+    def __init__(self, sock):
+        self.sock = sock
+        self.keep_alive = False
+        self.supports_chunked = True
+        self.requests_served = 0
+        self.parser = RequestParser()
+        self.route = 'file'
+        self.status = None
+        self.bytes_sent = 0
+        self.send_time = 0.0
+        self._poller = None
+    
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+    
+    def has_input(self, timeout=0):
+        """True if bytes (or EOF) arrive within timeout seconds."""
+        if not hasattr(select, 'poll'):
+            return bool(select.select([self.sock], [], [], timeout)[0])
+        if self._poller is None:
+            self._poller = select.poll()
+            self._poller.register(self.sock, select.POLLIN)
+        return bool(self._poller.poll(timeout * 1000))
+    
+    def send(self, data):
+        send_start = time.perf_counter()
+        try:
+            sent = self.sock.send(data)
+            _note_response_bytes(self, data[:sent])
+            return sent
+        finally:
+            self.send_time += time.perf_counter() - send_start
+    
+    def sendall(self, data):
+        send_start = time.perf_counter()
+        try:
+            self.sock.sendall(data)
+            _note_response_bytes(self, data)
+        finally:
+            self.send_time += time.perf_counter() - send_start
+    
+    def sendmsg(self, buffers):
+        send_start = time.perf_counter()
+        try:
+            sent = self.sock.sendmsg(buffers)
+            _note_response_bytes(self, buffers[0], sent)
+            return sent
+        finally:
+            self.send_time += time.perf_counter() - send_start
+    
+    def sendfile(self, file, offset=0, count=None):
+        send_start = time.perf_counter()
+        try:
+            sent = self.sock.sendfile(file, offset, count)
+            self.bytes_sent += sent
+            return sent
+        finally:
+            self.send_time += time.perf_counter() - send_start
+
+class BufferedConnection:
+    """
+    Connection stand-in for the asyncio engine.
+    
+    The synchronous routing code writes into it as if it were a socket;
+    the event loop then flushes the collected bytes without blocking.
+    """
+    
+    def __init__(self):
+        self.keep_alive = False
+        self.supports_chunked = True
+        self.requests_served = 0
+        self.parser = RequestParser()
+        self.route = 'file'
+        self.status = None
+        self.bytes_sent = 0
+        self.send_time = 0.0
+        self.pending = []
+        # Requests answered into the buffer but not yet flushed; their
+        # latency is recorded once the flush time is known.
+        self.unobserved = []
+    
+    def send(self, data):
+        self.pending.append(bytes(data))
+        _note_response_bytes(self, data)
+        return len(data)
+    
+    def sendall(self, data):
+        self.pending.append(bytes(data))
+        _note_response_bytes(self, data)
+    
+    def sendfile(self, file, offset=0, count=None):
+        if count is None:
+            count = os.fstat(file.fileno()).st_size - offset
+        self.bytes_sent += count
+        # The caller closes its file once routing returns, so keep a
+        # duplicate descriptor until the loop has sent the range.
+        file_copy = open(os.dup(file.fileno()), 'rb')
+        self.pending.append((file_copy, offset, count))
+    
+    async def flush(self, writer):
+        loop = asyncio.get_running_loop()
+        pending, self.pending = self.pending, []
+        
+        # Adjacent byte parts (a head and its body, pipelined responses)
+        # go out in one write so they share segments instead of the second
+        # waiting on the peer's delayed ACK.
+        data = []
+        try:
+            while pending:
+                part = pending.pop(0)
+                if isinstance(part, tuple):
+                    if data:
+                        writer.write(b''.join(data))
+                        data.clear()
+                    file_copy, offset, count = part
+                    with file_copy:
+                        await writer.drain()
+                        await loop.sendfile(writer.transport, file_copy, offset, count)
+                else:
+                    data.append(part)
+            if data:
+                writer.write(b''.join(data))
+            await writer.drain()
+        finally:
+            self.discard(pending)
+    
+    def discard(self, pending=None):
+        for part in (self.pending if pending is None else pending):
+            if isinstance(part, tuple):
+                part[0].close()
+        if pending is None:
+            self.pending = []
+
+class PerThreadShards:
+    """
+    Registry of per-thread dicts: each thread writes only its own shard.
+    
+    A thread that exits calls release_thread_shards(), which folds its
+    shards into each registry's base shard, so short-lived workers do not
+    leave shards behind for every reader to merge forever.
+    """
+    
+    _registries = weakref.WeakSet()
+    _registries_lock = threading.Lock()
+    
+    def __init__(self):
+        self._local = threading.local()
+        self._base = {}
+        self._shards = [self._base]
+        self._shards_lock = threading.Lock()
+        with PerThreadShards._registries_lock:
+            PerThreadShards._registries.add(self)
+    
+    def _get_shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+    
+    def _all_shards(self):
+        with self._shards_lock:
+            return list(self._shards)
+    
+    def _release_shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            return
+        del self._local.shard
+        # Readers merge outside the lock from a copy of the list, so the base
+        # is never changed in place: the fold goes into a new base, swapped
+        # in together with the shard's removal. A reader sees either the old
+        # base and the shard or the new base, never the shard twice.
+        with self._shards_lock:
+            base = {}
+            self._fold(base, self._base)
+            self._fold(base, shard)
+            # By identity: list.remove would match any shard with equal contents.
+            self._shards = [base] + [other for other in self._shards
+                                     if other is not shard and other is not self._base]
+            self._base = base
+    
+    def _fold(self, target, shard):
+        raise NotImplementedError
+
+def release_thread_shards():
+    """Fold the calling thread's shards into their registries' base shards."""
+    with PerThreadShards._registries_lock:
+        registries = list(PerThreadShards._registries)
+    for registry in registries:
+        registry._release_shard()
+
+class ShardedCounter(PerThreadShards):
+    """
+    Hit counter split into one shard per thread.
+    
+    Each thread only ever writes its own dict, so increments need no lock
+    and stay exact; readers merge the shards on demand.
+    """
+    
+    def increment(self, key):
+        shard = self._get_shard()
+        shard[key] = shard.get(key, 0) + 1
+    
+    def _fold(self, target, shard):
+        for key, value in shard.items():
+            target[key] = target.get(key, 0) + value
+    
+    def snapshot(self):
+        merged = defaultdict(int)
+        for shard in self._all_shards():
+            for key, value in shard.copy().items():
+                merged[key] += value
+        return dict(merged)
+
+class LatencyHistogram(PerThreadShards):
+    """
+    Log-bucketed latency histogram keyed by a tuple of label values.
+    
+    Buckets double from 100us to about 26s. Observations go to the calling
+    thread's shard without locking; snapshot() merges the shards.
+    """
+    
+    BUCKETS = tuple(0.0001 * 2 ** i for i in range(19))
+    
+    def observe(self, labels, seconds):
+        shard = self._get_shard()
+        series = shard.get(labels)
+        if series is None:
+            series = [[0] * (len(self.BUCKETS) + 1), 0.0, 0]
+            shard[labels] = series
+        series[0][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        series[1] += seconds
+        series[2] += 1
+    
+    def _fold(self, target, shard):
+        for labels, (counts, total, count) in shard.items():
+            series = target.get(labels)
+            if series is None:
+                target[labels] = [list(counts), total, count]
+                continue
+            for index, value in enumerate(counts):
+                series[0][index] += value
+            series[1] += total
+            series[2] += count
+    
+    def snapshot(self):
+        """Return {labels: (bucket_counts, sum, count)} merged across threads."""
+        merged = {}
+        for shard in self._all_shards():
+            for labels, (counts, total, count) in shard.copy().items():
+                if labels not in merged:
+                    merged[labels] = [[0] * len(counts), 0.0, 0]
+                target = merged[labels]
+                for index, value in enumerate(list(counts)):
+                    target[0][index] += value
+                target[1] += total
+                target[2] += count
+        return {labels: tuple(series) for labels, series in merged.items()}
+    
+    def render_prometheus(self, name, label_names):
+        """Format the histogram in the Prometheus text exposition format."""
+        lines = []
+        for labels, (counts, total, count) in sorted(self.snapshot().items()):
+            label_text = ','.join(f'{key}="{value}"' for key, value in zip(label_names, labels))
+            prefix = label_text + ',' if label_text else ''
+            cumulative = 0
+            for bound, bucket_count in zip(self.BUCKETS, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{{prefix}le="{bound:g}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {count}')
+            suffix = '{' + label_text + '}' if label_text else ''
+            lines.append(f'{name}_sum{suffix} {total:.6f}')
+            lines.append(f'{name}_count{suffix} {count}')
+        return lines
+
+class TokenBucketLimiter:
+    """
+    Per-IP token bucket rate limiter with bounded memory.
+    
+    Each IP holds only (tokens, last_refill), refilled lazily on access.
+    IPs are spread over independently locked stripes, and each stripe is
+    kept in LRU order so idle or excess entries are evicted from the front.
+    """
+    
+    def __init__(self, rate, burst=None, num_stripes=16, max_tracked_ips=10000):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        # A bucket idle this long has refilled completely, so dropping it
+        # loses no state.
+        self.idle_timeout = self.burst / self.rate
+        self.max_per_stripe = max(1, max_tracked_ips // num_stripes)
+        
+        self.stripes = [OrderedDict() for _ in range(num_stripes)]
+        self.locks = [threading.Lock() for _ in range(num_stripes)]
+        self.evictions = [0] * num_stripes
+    
+    def allow(self, client_ip):
+        index = hash(client_ip) % len(self.stripes)
+        buckets = self.stripes[index]
+        now = time.monotonic()
+        
+        with self.locks[index]:
+            bucket = buckets.get(client_ip)
+            if bucket is None:
+                bucket = [self.burst, now]
+                buckets[client_ip] = bucket
+            else:
+                buckets.move_to_end(client_ip)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            
+            self._evict(index, now)
+            
+            if bucket[0] < 1.0:
+                return False
+            bucket[0] -= 1.0
+            return True
+    
+    def _evict(self, index, now):
+        buckets = self.stripes[index]
+        while buckets:
+            oldest_ip, (_, last_seen) = next(iter(buckets.items()))
+            if len(buckets) <= self.max_per_stripe and now - last_seen < self.idle_timeout:
+                break
+            del buckets[oldest_ip]
+            self.evictions[index] += 1
+    
+    def get_statistics(self):
+        return {
+            'tracked_ips': sum(len(buckets) for buckets in self.stripes),
+            'evictions': sum(self.evictions)
+        }
+
+class ListingTemplate:
+    """
+    Directory listing rendered once per directory version.
+    
+    pieces holds the static HTML as bytes; slots names the value spliced
+    in between each pair of pieces when a response is built.
+    """
+    
+    def __init__(self, mtime_ns, entries):
+        self.mtime_ns = mtime_ns
+        self.entries = entries
+        self.pieces = []
+        self.slots = []
+        self._current = []
+    
+    def text(self, html):
+        self._current.append(html)
+    
+    def slot(self, kind, name):
+        self.pieces.append(''.join(self._current).encode('utf-8'))
+        self._current = []
+        self.slots.append((kind, name))
+    
+    def finish(self):
+        self.pieces.append(''.join(self._current).encode('utf-8'))
+        self._current = []
+    
+    def render(self, stats, request_counts):
+        parts = [self.pieces[0]]
+        for (kind, name), piece in zip(self.slots, self.pieces[1:]):
+            if kind == 'count':
+                value = request_counts.get(name, 0)
+            else:
+                value = stats[name]
+            parts.append(str(value).encode('utf-8'))
+            parts.append(piece)
+        return b''.join(parts)
+
+class ListingCache:
+    """Bounded LRU of ListingTemplates, invalidated by directory mtime."""
+    
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, key, mtime_ns):
+        with self.lock:
+            template = self.entries.get(key)
+            if template is None or template.mtime_ns != mtime_ns:
+                return None
+            self.entries.move_to_end(key)
+            return template
+    
+    def put(self, key, template):
+        with self.lock:
+            self.entries[key] = template
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+class ResolvedPath:
+    """
+    A request path checked against the serve root. file_path is the joined
+    path (it names the resource, e.g. for its content type); real_path is
+    the canonical path that passed the traversal check and is the only one
+    that may be opened or statted, so a symlink re-pointed after the check
+    cannot redirect the open.
+    """
+    
+    def __init__(self, file_path, real_path, allowed, st):
+        self.file_path = file_path
+        self.real_path = real_path
+        self.allowed = allowed
+        self.st = st
+        self.is_dir = st is not None and stat.S_ISDIR(st.st_mode)
+        self.resolved_at = time.monotonic()
+
+class PathCache:
+    """
+    Bounded LRU mapping raw request paths to their resolved file path,
+    traversal-check verdict and stat result.
+    
+    Entries (including misses) are trusted for ttl seconds, so hot paths
+    skip realpath and stat entirely; after that they are resolved again,
+    which picks up new, deleted or re-linked files.
+    """
+    
+    def __init__(self, real_root, max_entries=4096, ttl=1.0):
+        self.real_root = real_root
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+    
+    def resolve(self, requested_path):
+        with self.lock:
+            entry = self.entries.get(requested_path)
+            if entry is not None and time.monotonic() - entry.resolved_at < self.ttl:
+                self.entries.move_to_end(requested_path)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        
+        entry = self._resolve(requested_path)
+        with self.lock:
+            self.entries[requested_path] = entry
+            self.entries.move_to_end(requested_path)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+    
+    def _resolve(self, requested_path):
+        """
+        Raises:
+            ValueError/OSError if the path cannot be resolved at all
+        """
+        file_path = os.path.join(self.real_root, requested_path)
+        real_path = os.path.realpath(file_path)
+        allowed = real_path == self.real_root or real_path.startswith(self.real_root + os.sep)
+        if not allowed:
+            return ResolvedPath(file_path, real_path, False, None)
+        
+        try:
+            st = os.stat(real_path)
+        except (FileNotFoundError, NotADirectoryError):
+            st = None
+        # realpath drops a trailing slash, which only a directory may carry.
+        if st is not None and file_path.endswith('/') and not stat.S_ISDIR(st.st_mode):
+            st = None
+        return ResolvedPath(file_path, real_path, True, st)
+    
+    def get_statistics(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+class IndexEntry(ResolvedPath):
+    """A preindexed file or directory with its response metadata worked out."""
+    
+    def __init__(self, file_path, real_path, st, content_type=None, etag=None,
+                 header_prefix=None):
+        super().__init__(file_path, real_path, True, st)
+        self.content_type = content_type
+        self.etag = etag
+        self.header_prefix = header_prefix
+
+class ContentIndex:
+    """
+    In-memory index of the serve tree, keyed by request path relative to
+    the root ('.', 'books', 'books/doc2.pdf').
+    
+    Built at startup by walking the tree, statting each directory's files
+    on a small thread pool, then rebuilt every rescan_interval seconds on
+    a background thread. Only canonical paths of files that really live
+    under the root are indexed; anything else falls back to PathCache.
+    """
+    
+    def __init__(self, real_root, make_entry, rescan_interval=5.0, scan_threads=4):
+        self.real_root = real_root
+        self.make_entry = make_entry
+        self.rescan_interval = rescan_interval
+        self.scan_threads = scan_threads
+        self.entries = {}
+        self.scans = 0
+        self.last_scan_time = 0.0
+        
+        self.rescan()
+        if rescan_interval > 0:
+            threading.Thread(target=self._rescan_loop, name="ContentIndex", daemon=True).start()
+    
+    def lookup(self, requested_path):
+        entry = self.entries.get(requested_path)
+        if entry is None and requested_path.endswith('/'):
+            entry = self.entries.get(requested_path.rstrip('/'))
+            if entry is not None and not entry.is_dir:
+                return None
+        return entry
+    
+    def rescan(self):
+        scan_start = time.perf_counter()
+        directories = []
+        for dir_path, _, _ in os.walk(self.real_root):
+            directories.append(dir_path)
+        
+        entries = {}
+        with ThreadPoolExecutor(max_workers=self.scan_threads) as executor:
+            for part in executor.map(self._scan_directory, directories):
+                entries.update(part)
+        
+        # Swapping the whole dict keeps lookups lock-free.
+        self.entries = entries
+        self.scans += 1
+        self.last_scan_time = time.perf_counter() - scan_start
+    
+    def _scan_directory(self, dir_path):
+        entries = {}
+        relative_dir = os.path.relpath(dir_path, self.real_root)
+        try:
+            entries[relative_dir] = self.make_entry(dir_path, dir_path, os.stat(dir_path))
+            scanned = list(os.scandir(dir_path))
+        except OSError:
+            return entries
+        
+        for dir_entry in scanned:
+            if dir_entry.is_dir():
+                # Walked separately (symlinked directories are not walked
+                # and are left to PathCache).
+                continue
+            # os.walk does not follow links, so only symlinked files can
+            # point elsewhere. Their target is indexed and served instead
+            # of the link, so re-pointing the link later has no effect.
+            real_path = dir_entry.path
+            try:
+                if dir_entry.is_symlink():
+                    real_path = os.path.realpath(dir_entry.path)
+                    if not real_path.startswith(self.real_root + os.sep):
+                        continue
+                    st = os.stat(real_path)
+                else:
+                    st = dir_entry.stat()
+            except OSError:
+                continue
+            key = dir_entry.name if relative_dir == '.' else f"{relative_dir}/{dir_entry.name}"
+            entries[key] = self.make_entry(dir_entry.path, real_path, st)
+        return entries
+    
+    def _rescan_loop(self):
+        while True:
+            time.sleep(self.rescan_interval)
+            try:
+                self.rescan()
+            except Exception as e:
+                print(f"[ContentIndex] Rescan failed: {e}")
+    
+    def get_statistics(self):
+        entries = self.entries
+        directories = sum(1 for entry in entries.values() if entry.is_dir)
+        return {
+            'files': len(entries) - directories,
+            'directories': directories,
+            'scans': self.scans,
+            'last_scan_time': self.last_scan_time
+        }
+
+class CacheEntry:
+    
+    def __init__(self, file_path, mtime, size, header_prefix, body, etag=None, origin=None):
+        self.file_path = file_path
+        self.mtime = mtime
+        self.size = size
+        # (path, mtime, size) of the original file when the body was read
+        # from a precompressed sibling; an edit to it retires the entry too.
+        self.origin = origin
+        self.etag = etag
+        self.header_prefix = header_prefix
+        self.body = body
+        self.checked_at = time.time()
+    
+    def cost(self):
+        return len(self.header_prefix) + len(self.body)
+
+class ResponseCache:
+    """
+    LRU cache of pre-built responses for small, frequently requested files.
+    
+    Entries are bounded by a total byte budget and are revalidated against
+    the file's mtime and size (and the original's, for a precompressed
+    sibling) at most once per revalidate_interval, so hot hits in between
+    never touch the filesystem.
+    """
+    
+    def __init__(self, max_bytes, max_file_size, revalidate_interval=1.0):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.revalidate_interval = revalidate_interval
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            needs_check = time.time() - entry.checked_at >= self.revalidate_interval
+        
+        if needs_check:
+            try:
+                st = os.stat(entry.file_path)
+                valid = st.st_mtime == entry.mtime and st.st_size == entry.size
+                if valid and entry.origin is not None:
+                    origin_path, origin_mtime, origin_size = entry.origin
+                    st = os.stat(origin_path)
+                    valid = st.st_mtime == origin_mtime and st.st_size == origin_size
+            except OSError:
+                valid = False
+            
+            with self.lock:
+                if not valid:
+                    self._remove(key, entry)
+                    self.misses += 1
+                    return None
+                entry.checked_at = time.time()
+        
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            self.hits += 1
+        return entry
+    
+    def put(self, key, entry):
+        if entry.cost() > self.max_bytes:
+            return
+        
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old.cost()
+            
+            self.entries[key] = entry
+            self.current_bytes += entry.cost()
+            
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.current_bytes -= evicted.cost()
+                self.evictions += 1
+    
+    def _remove(self, key, entry):
+        if self.entries.get(key) is entry:
+            del self.entries[key]
+            self.current_bytes -= entry.cost()
+    
+    def get_statistics(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes
+            }
+
+class MappedFile:
+    """A read-only mapping of one version of a file, shared between requests."""
+    
+    def __init__(self, key, file_obj, size):
+        self.key = key
+        self.size = size
+        self.map = mmap.mmap(file_obj.fileno(), size, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        self.refcount = 0
+    
+    def close(self):
+        self.view.release()
+        self.map.close()
+
+class MappedFileCache:
+    """
+    Reference-counted pool of MappedFile objects keyed by (path, inode, mtime).
+    
+    Concurrent downloads of the same file share one mapping, so they read
+    the same page-cache pages instead of each holding a private copy.
+    Mappings nobody is using are unmapped LRU-first once more than
+    max_files are open, or as soon as the file changes on disk.
+    """
+    
+    def __init__(self, max_files=64):
+        self.max_files = max_files
+        self.mappings = OrderedDict()
+        self.lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+        self.unmapped = 0
+    
+    def acquire(self, path, file_obj, st):
+        """Return a mapping of file_obj with its reference held, or None for empty files."""
+        if st.st_size == 0:
+            return None
+        
+        key = (path, st.st_ino, st.st_mtime_ns)
+        with self.lock:
+            mapped = self.mappings.get(key)
+            if mapped is not None:
+                self.mappings.move_to_end(key)
+                mapped.refcount += 1
+                self.hits += 1
+                return mapped
+            self.misses += 1
+        
+        mapped = MappedFile(key, file_obj, st.st_size)
+        with self.lock:
+            existing = self.mappings.get(key)
+            if existing is not None:
+                # Another request mapped it meanwhile; use theirs.
+                mapped.close()
+                mapped = existing
+                self.mappings.move_to_end(key)
+            else:
+                self.mappings[key] = mapped
+            mapped.refcount += 1
+            self._evict(path, key)
+        return mapped
+    
+    def release(self, mapped):
+        with self.lock:
+            mapped.refcount -= 1
+            if mapped.refcount == 0 and self.mappings.get(mapped.key) is not mapped:
+                # Already evicted while in use; the last user unmaps it.
+                mapped.close()
+                self.unmapped += 1
+    
+    def _evict(self, path, current_key):
+        # Caller holds lock. Stale versions of this path go first, then
+        # the least recently used idle mappings while over the limit.
+        for key in [key for key in self.mappings if key[0] == path and key != current_key]:
+            self._drop(key)
+        
+        for key in list(self.mappings):
+            if len(self.mappings) <= self.max_files:
+                break
+            if key != current_key:
+                self._drop(key)
+    
+    def _drop(self, key):
+        mapped = self.mappings.pop(key)
+        if mapped.refcount == 0:
+            mapped.close()
+            self.unmapped += 1
+    
+    def get_statistics(self):
+        with self.lock:
+            return {
+                'mappings': len(self.mappings),
+                'mapped_bytes': sum(mapped.size for mapped in self.mappings.values()),
+                'in_use': sum(1 for mapped in self.mappings.values() if mapped.refcount),
+                'hits': self.hits,
+                'misses': self.misses,
+                'unmapped': self.unmapped
+            }
+    
+    def close(self):
+        with self.lock:
+            for key in list(self.mappings):
+                self._drop(key)
+
+class AccessLog:
+    """
+    Access log written by a background thread.
+    
+    Request threads only append a tuple to a bounded deque; formatting and
+    writing happen in batches on the writer thread. When the buffer is full
+    the record is dropped and counted rather than blocking the request.
+    """
+    
+    FORMATS = ('common', 'json', 'off')
+    
+    def __init__(self, log_format='common', sample_rate=1.0, capacity=8192,
+                 batch_size=256, flush_interval=0.2, stream=None):
+        self.log_format = log_format
+        self.sample_rate = sample_rate
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stream = stream or sys.stdout
+        
+        self.buffer = deque()
+        self.logged = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        
+        self.wakeup = threading.Event()
+        self.is_running = True
+        self.writer = threading.Thread(target=self._writer_loop, name="AccessLog", daemon=True)
+        self.writer.start()
+    
+    def log_request(self, client_ip, request, status, bytes_sent, elapsed):
+        if self.log_format == 'off':
+            return
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return
+        self._append(('request', time.time(), client_ip, request.method, request.path,
+                      request.version, status, bytes_sent, elapsed))
+    
+    def message(self, text):
+        """Queue a free-form server message (errors, rate limiting)."""
+        self._append(('message', time.time(), text))
+    
+    def _append(self, record):
+        # deque.append is atomic; the length check may overshoot capacity by
+        # a few records under contention, which is fine for a soft bound.
+        if len(self.buffer) >= self.capacity:
+            self.dropped += 1
+            return
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_size:
+            self.wakeup.set()
+    
+    def _writer_loop(self):
+        while self.is_running:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self._drain()
+    
+    def _drain(self):
+        while self.buffer:
+            batch = []
+            while self.buffer and len(batch) < self.batch_size:
+                batch.append(self.buffer.popleft())
+            
+            try:
+                self.stream.write(''.join(self._format(record) for record in batch))
+                self.stream.flush()
+            except (OSError, ValueError):
+                pass
+            self.logged += len(batch)
+    
+    def _format(self, record):
+        if record[0] == 'message':
+            _, timestamp, text = record
+            if self.log_format == 'json':
+                return json.dumps({'time': timestamp, 'message': text}) + '\n'
+            return text + '\n'
+        
+        _, timestamp, client_ip, method, path, version, status, bytes_sent, elapsed = record
+        if self.log_format == 'json':
+            return json.dumps({
+                'time': timestamp,
+                'client': client_ip,
+                'method': method,
+                'path': path,
+                'version': version,
+                'status': status,
+                'bytes': bytes_sent,
+                'duration_ms': round(elapsed * 1000, 3)
+            }) + '\n'
+        
+        when = datetime.fromtimestamp(timestamp).astimezone().strftime('%d/%b/%Y:%H:%M:%S %z')
+        return (f'{client_ip} - - [{when}] "{method} {path} {version}" '
+                f'{status or "-"} {bytes_sent or "-"} {elapsed * 1000:.3f}ms\n')
+    
+    def get_statistics(self):
+        return {
+            'logged': self.logged,
+            'dropped': self.dropped,
+            'sampled_out': self.sampled_out,
+            'buffered': len(self.buffer)
+        }
+    
+    def close(self):
+        self.is_running = False
+        self.wakeup.set()
+        self.writer.join(timeout=2)
+        self._drain()
+
 class HTTPFileServer:
     
     def __init__(self, serve_directory, host='0.0.0.0', port=8080, 
                  num_threads=4, simulate_work_delay=0, use_locks=True,
-                 enable_rate_limiting=False, rate_limit=5):
+                 enable_rate_limiting=False, rate_limit=5,
+                 keep_alive_timeout=5, max_keep_alive_requests=100,
+                 engine='threads', cache_size=16 * 1024 * 1024,
+                 cache_max_file_size=1024 * 1024, reuse_port=False,
+                 max_tracked_ips=10000, listen_backlog=128, max_queue_size=256,
+                 overload_policy='503', retry_after=1, max_threads=None,
+                 access_log_format='common', access_log_sample=1.0,
+                 use_mmap=False, mmap_max_files=64, preindex=False, rescan_interval=5.0):
         self.serve_directory = os.path.abspath(serve_directory)
+        # Resolved once: symlinks in the root itself never change per request.
+        self.real_serve_directory = os.path.realpath(self.serve_directory)
         self.host = host
         self.port = port
         self.simulate_work_delay = simulate_work_delay
         self.use_locks = use_locks
         self.enable_rate_limiting = enable_rate_limiting
         self.rate_limit = rate_limit
+        self.keep_alive_timeout = keep_alive_timeout
+        self.max_keep_alive_requests = max_keep_alive_requests
+        self.engine = engine
+        self.listen_backlog = listen_backlog
+        self.overload_policy = overload_policy
+        self.retry_after = retry_after
+        self.shed_connections = 0
+        
+        self._header_templates = {}
+        self._keep_alive_headers = (
+            f"Connection: keep-alive\r\n"
+            f"Keep-Alive: timeout={keep_alive_timeout}, max={max_keep_alive_requests}\r\n\r\n"
+        ).encode('latin-1')
+        self._close_headers = b"Connection: close\r\n\r\n"
+        shed_body = b"<html><body><h1>503 Service Unavailable</h1></body></html>"
+        self._shed_response = (
+            self._header_template(503, HTML_CONTENT_TYPE)
+            + b"Content-Length: %d\r\n" % len(shed_body)
+            + f"Retry-After: {retry_after}\r\n".encode('latin-1')
+            + self._close_headers
+            + shed_body
+        )
+        
+        self.listing_cache = ListingCache()
+        self.path_cache = PathCache(self.real_serve_directory)
+        if preindex:
+            self.content_index = ContentIndex(self.real_serve_directory, self._make_index_entry,
+                                              rescan_interval)
+        else:
+            self.content_index = None
+        self.request_latency = LatencyHistogram()
+        self.access_log = AccessLog(access_log_format, sample_rate=access_log_sample)
         
-        self.request_counter = defaultdict(int)
-        self.counter_lock = threading.Lock() 
+        if cache_size > 0:
+            self.response_cache = ResponseCache(cache_size, cache_max_file_size)
+        else:
+            self.response_cache = None
         
-        self.ip_requests = defaultdict(list)  
-        self.rate_limit_lock = threading.Lock()  
+        if use_mmap:
+            self.mapped_files = MappedFileCache(mmap_max_files)
+        else:
+            self.mapped_files = None
+        
+        if use_locks:
+            self.request_counter = ShardedCounter()
+        else:
+            self.request_counter = defaultdict(int)
+        
+        if enable_rate_limiting:
+            self.rate_limiter = TokenBucketLimiter(rate_limit, max_tracked_ips=max_tracked_ips)
+        else:
+            self.rate_limiter = None
         
         self.total_requests = 0
         self.blocked_requests = 0
         self.stats_lock = threading.Lock()
         
-        self.thread_pool = ThreadPool(num_threads=num_threads)
+        if engine == 'asyncio':
+            self.thread_pool = None
+            self.idle_connections = None
+        else:
+            self.thread_pool = ThreadPool(num_threads=num_threads, max_queue_size=max_queue_size,
+                                          max_threads=max_threads, log=self.access_log.message)
+            self.idle_connections = IdleConnections(self._resume_connection, keep_alive_timeout,
+                                                    log=self.access_log.message)
         
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.server_socket.bind((self.host, self.port))
+        # Port 0 asks the OS for a free port; report the real one.
+        self.port = self.server_socket.getsockname()[1]
         self.server_socket.settimeout(1.0)
         
         print(f"\n[Server] Configuration:")
         print(f"  - Serving from: {self.serve_directory}")
         print(f"  - Address: {self.host}:{self.port}")
-        print(f"  - Thread pool size: {num_threads}")
+        print(f"  - Engine: {engine}")
+        if engine != 'asyncio':
+            if max_threads and max_threads > num_threads:
+                print(f"  - Thread pool size: {num_threads}-{max_threads} (elastic)")
+            else:
+                print(f"  - Thread pool size: {num_threads}")
+            print(f"  - Queue limit: {max_queue_size or 'unbounded'} "
+                  f"(overload policy: {overload_policy})")
+        print(f"  - Listen backlog: {listen_backlog}")
         print(f"  - Work delay: {simulate_work_delay}s")
         print(f"  - Thread-safe locks: {'ENABLED' if use_locks else 'DISABLED (RACE CONDITION!)'}")
         print(f"  - Rate limiting: {'ENABLED' if enable_rate_limiting else 'DISABLED'}")
         if enable_rate_limiting:
-            print(f"  - Rate limit: {rate_limit} req/sec per IP")
+            print(f"  - Rate limit: {rate_limit} req/sec per IP (tracking up to {max_tracked_ips} IPs)")
+        if self.response_cache is not None:
+            print(f"  - Response cache: {cache_size // 1024} KB "
+                  f"(files up to {cache_max_file_size // 1024} KB)")
+        else:
+            print(f"  - Response cache: DISABLED")
+        if use_mmap:
+            print(f"  - Memory-mapped files: up to {mmap_max_files} shared mappings")
+        if self.content_index is not None:
+            index_stats = self.content_index.get_statistics()
+            print(f"  - Content index: {index_stats['files']} files, "
+                  f"{index_stats['directories']} directories in "
+                  f"{index_stats['last_scan_time'] * 1000:.1f}ms, rescan every {rescan_interval}s")
+        print(f"  - Keep-alive: {keep_alive_timeout}s idle timeout, {max_keep_alive_requests} requests max")
+        print(f"  - Access log: {access_log_format}"
+              + (f" (sampling {access_log_sample:g})" if access_log_sample < 1.0 else ""))
     
     def start(self):
-        self.server_socket.listen(5)
+        self.server_socket.listen(self.listen_backlog)
         print(f"\n[Server] Listening on {self.host}:{self.port}")
         print("[Server] Press Ctrl+C to stop\n")
         
         try:
-            while True:
-                try:
-                    client_socket, client_address = self.server_socket.accept()
-                    
-                    self.thread_pool.submit(
-                        self.handle_request, 
-                        client_socket, 
-                        client_address
-                    )
-                    
-                except socket.timeout:
-                    continue
-                except Exception as e:
-                    print(f"[Server] Error accepting connection: {e}")
-                    
+            if self.engine == 'asyncio':
+                asyncio.run(self._serve_asyncio())
+            else:
+                self._accept_loop()
         except KeyboardInterrupt:
             print("\n[Server] Keyboard interrupt received")
         finally:
             self.shutdown()
     
+    def _accept_loop(self):
+        while True:
+            try:
+                client_socket, client_address = self.server_socket.accept()
+                
+                submitted = self.thread_pool.submit(
+                    self.handle_request, 
+                    client_socket, 
+                    client_address
+                )
+                if not submitted:
+                    self._shed_connection(client_socket)
+                
+            except socket.timeout:
+                continue
+            except Exception as e:
+                self.access_log.message(f"[Server] Error accepting connection: {e}")
+    
+    def _shed_connection(self, client_socket):
+        """Turn away a connection the pool has no room for, without queueing it."""
+        with self.stats_lock:
+            self.shed_connections += 1
+        
+        try:
+            if self.overload_policy == '503':
+                client_socket.settimeout(0.1)
+                client_socket.sendall(self._shed_response)
+                client_socket.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        finally:
+            client_socket.close()
+    
+    async def _serve_asyncio(self):
+        self.server_socket.setblocking(False)
+        # start_server calls listen() again on sock, so the backlog has
+        # to be passed here too or it falls back to asyncio's default.
+        server = await asyncio.start_server(
+            self.handle_request_async,
+            sock=self.server_socket,
+            backlog=self.listen_backlog
+        )
+        async with server:
+            await server.serve_forever()
+    
     def handle_request(self, client_socket, client_address):
-        start_time = time.time()
-        client_ip = client_address[0]
+        _set_nodelay(client_socket)
+        connection = ClientConnection(client_socket)
+        connection.settimeout(self.keep_alive_timeout)
+        self._serve_connection(connection, client_address[0])
+    
+    def _idle_grace(self):
+        # A client that keeps its connection busy usually sends again
+        # within a round trip; waiting briefly for it is cheaper than the
+        # trip through the poller, but only while nobody else is queued.
+        if self.thread_pool.get_queue_size() > 0:
+            return 0
+        return KEEP_ALIVE_GRACE
+    
+    def _resume_connection(self, connection, client_ip):
+        """Called by IdleConnections once a parked connection has input."""
+        if not self.thread_pool.submit(self._serve_connection, connection, client_ip):
+            self._shed_connection(connection.sock)
+    
+    def _serve_connection(self, connection, client_ip):
+        parked = False
+        try:
+            while True:
+                # Nothing to read yet: hand the connection to the idle poller
+                # instead of holding this worker in recv until the client
+                # sends again or the keep-alive timeout expires.
+                if not connection.parser.buffer and not connection.has_input(self._idle_grace()):
+                    parked = True
+                    break
+                if not self._handle_single_request(connection, client_ip):
+                    break
+                if not connection.keep_alive:
+                    break
+        except socket.timeout:
+            pass
+        except Exception as e:
+            self.access_log.message(f"[{client_ip}] Error: {e}")
+            connection.keep_alive = False
+            try:
+                self.send_error_response(connection, 500, "Internal Server Error")
+            except:
+                pass
+        finally:
+            if parked:
+                self.idle_connections.park(connection, client_ip)
+            else:
+                connection.sock.close()
+    
+    async def handle_request_async(self, reader, writer):
+        client_ip = writer.get_extra_info('peername')[0]
+        # asyncio only sets TCP_NODELAY itself for sockets created with
+        # proto=IPPROTO_TCP, which the listening socket was not.
+        _set_nodelay(writer.get_extra_info('socket'))
+        connection = BufferedConnection()
+        
+        try:
+            while True:
+                try:
+                    request = connection.parser.next_request()
+                except RequestError as e:
+                    self._reject_request(connection, e)
+                    await self._flush_async(connection, writer, client_ip)
+                    break
+                
+                if request is None:
+                    # Flush everything answered so far before waiting for
+                    # more input, so pipelined responses go out together.
+                    await self._flush_async(connection, writer, client_ip)
+                    data = await asyncio.wait_for(
+                        reader.read(4096), self.keep_alive_timeout
+                    )
+                    if not data:
+                        break
+                    connection.parser.feed(data)
+                    continue
+                
+                if self._begin_request(connection, client_ip, request):
+                    if self.simulate_work_delay > 0:
+                        await asyncio.sleep(self.simulate_work_delay)
+                    self._dispatch_request(connection, client_ip, request)
+                self._finish_request(connection, request)
+                connection.unobserved.append(request)
+                
+                if not connection.keep_alive:
+                    await self._flush_async(connection, writer, client_ip)
+                    break
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            self.access_log.message(f"[{client_ip}] Error: {e}")
+            connection.keep_alive = False
+            connection.discard()
+            try:
+                self.send_error_response(connection, 500, "Internal Server Error")
+                await self._flush_async(connection, writer, client_ip)
+            except:
+                pass
+        finally:
+            connection.discard()
+            writer.close()
+    
+    async def _flush_async(self, connection, writer, client_ip):
+        flush_start = time.perf_counter()
+        await connection.flush(writer)
+        
+        unobserved, connection.unobserved = connection.unobserved, []
+        if unobserved:
+            share = (time.perf_counter() - flush_start) / len(unobserved)
+            for request in unobserved:
+                request.send_time += share
+                self._record_request(client_ip, request)
+    
+    def _handle_single_request(self, connection, client_ip):
+        """
+        Read and answer one request on a connection.
+        
+        Returns:
+            False if the client closed the connection, True otherwise
+        """
+        try:
+            request = self._read_request(connection)
+        except RequestError as e:
+            self._reject_request(connection, e)
+            return True
+        
+        if request is None:
+            return False
+        
+        if self._begin_request(connection, client_ip, request):
+            if self.simulate_work_delay > 0:
+                time.sleep(self.simulate_work_delay)
+            
+            self._dispatch_request(connection, client_ip, request)
+        
+        self._finish_request(connection, request)
+        self._record_request(client_ip, request)
+        return True
+    
+    def _read_request(self, connection):
+        parser = connection.parser
+        while True:
+            request = parser.next_request()
+            if request is not None:
+                return request
+            
+            data = connection.recv(4096)
+            if not data:
+                return None
+            parser.feed(data)
+    
+    def _reject_request(self, connection, error):
+        connection.keep_alive = False
+        self.send_error_response(connection, error.status_code, error.status_text)
+    
+    def _begin_request(self, connection, client_ip, request):
+        """
+        Apply keep-alive rules and the rate limit to a parsed request.
+        
+        Returns:
+            True if the request should be dispatched, False if a response
+            was already sent
+        """
+        connection.route = 'file'
+        connection.status = None
+        connection.bytes_sent = 0
+        connection.requests_served += 1
+        connection.keep_alive = (
+            self._wants_keep_alive(request.version, request.headers)
+            and connection.requests_served < self.max_keep_alive_requests
+        )
+        connection.supports_chunked = request.version.strip() == 'HTTP/1.1'
+        
+        if self.enable_rate_limiting:
+            if not self._check_rate_limit(client_ip):
+                with self.stats_lock:
+                    self.blocked_requests += 1
+                self.send_error_response(connection, 429, "Too Many Requests")
+                return False
+        
+        with self.stats_lock:
+            self.total_requests += 1
+        
+        return True
+    
+    def _dispatch_request(self, connection, client_ip, request):
+        dispatch_start = time.perf_counter()
+        send_before = connection.send_time
+        
+        try:
+            if request.method != 'GET':
+                self.send_error_response(connection, 405, "Method Not Allowed")
+                return
+            
+            if request.path.partition('?')[0] == '/metrics':
+                connection.route = 'metrics'
+                self.serve_metrics(connection)
+                return
+            
+            self.serve_file(connection, request.path, client_ip, request.headers)
+        finally:
+            request.send_time = connection.send_time - send_before
+            request.handler_time = time.perf_counter() - dispatch_start - request.send_time
+    
+    def _finish_request(self, connection, request):
+        # Snapshot per-response state now; the asyncio engine records the
+        # request only after a later flush, by which time the connection
+        # may have moved on to the next pipelined request.
+        request.route = connection.route
+        request.status = connection.status
+        request.bytes_sent = connection.bytes_sent
+    
+    def _record_request(self, client_ip, request):
+        """Record per-phase latency (parse, filesystem, send, total) and log the request."""
+        total = time.perf_counter() - request.received_at
+        histogram = self.request_latency
+        route = request.route
+        histogram.observe((route, 'parse'), request.parse_time)
+        histogram.observe((route, 'filesystem'), request.handler_time)
+        histogram.observe((route, 'send'), request.send_time)
+        histogram.observe((route, 'total'), total)
+        self.access_log.log_request(client_ip, request, request.status, request.bytes_sent, total)
+    
+    def _wants_keep_alive(self, version, headers):
+        connection_tokens = [
+            token.strip().lower()
+            for token in headers.get('connection', '').split(',')
+        ]
+        if 'close' in connection_tokens:
+            return False
+        if version.strip() == 'HTTP/1.1':
+            return True
+        return 'keep-alive' in connection_tokens
+    
+    def _check_rate_limit(self, client_ip):
+        """
+        Check if client IP is within rate limit.
+        Thread-safe implementation.
+        
+        Returns:
+            True if request allowed, False if rate limited
+        """
+        return self.rate_limiter.allow(client_ip)
+    
+    def _increment_counter(self, path):
+
+        if self.use_locks:
+            self.request_counter.increment(path)
+        else:
+            current_value = self.request_counter[path]
+            time.sleep(0.002)
+            self.request_counter[path] = current_value + 1
+    
+    def _request_counts(self):
+        if self.use_locks:
+            return self.request_counter.snapshot()
+        return dict(self.request_counter)
+    
+    def serve_file(self, client_socket, requested_path, client_ip, request_headers=None):
+        """Serve a file or directory listing."""
+        requested_path, _, query_string = requested_path.partition('?')
+        
+        if requested_path.startswith('/'):
+            requested_path = requested_path[1:]
+        
+        if not requested_path:
+            requested_path = '.'
+        
+        self._increment_counter(requested_path)
+        
+        resolved = None
+        if self.content_index is not None:
+            resolved = self.content_index.lookup(requested_path)
+        
+        if resolved is None:
+            try:
+                resolved = self.path_cache.resolve(requested_path)
+            except (OSError, ValueError):
+                self.send_error_response(client_socket, 400, "Bad Request")
+                return
+        
+        if not resolved.allowed:
+            self.send_error_response(client_socket, 403, "Forbidden")
+            return
+        
+        if resolved.st is None:
+            self.send_error_response(client_socket, 404, "Not Found")
+            return
+        
+        # Only the canonical path is opened; the joined one may be a symlink
+        # that has been re-pointed since it was checked.
+        real_path = resolved.real_path
+        if resolved.is_dir:
+            query = parse_qs(query_string)
+            self.serve_directory_listing(client_socket, real_path, requested_path,
+                                         request_headers, query)
+            return
+        
+        content_type = self.get_content_type(resolved.file_path)
+        wants_range = request_headers is not None and 'range' in request_headers
+        
+        if self.response_cache is not None and not wants_range:
+            encoding = self._negotiate_encoding(request_headers, content_type)
+            entry = self.response_cache.get((real_path, encoding))
+            if entry is not None:
+                if self._is_not_modified(request_headers, entry.etag, entry.mtime):
+                    self.send_not_modified(client_socket, entry.etag, entry.mtime)
+                else:
+                    self.send_cached_response(client_socket, entry)
+                return
+        
+        self.serve_single_file(client_socket, real_path, request_headers, resolved.st,
+                               resolved if isinstance(resolved, IndexEntry) else None,
+                               content_type)
+    
+    def _make_index_entry(self, file_path, real_path, st):
+        if stat.S_ISDIR(st.st_mode):
+            return IndexEntry(file_path, real_path, st)
+        
+        content_type = self.get_content_type(file_path)
+        if content_type is None:
+            return IndexEntry(file_path, real_path, st)
+        
+        etag = self._make_etag(st)
+        header_prefix = (
+            self._header_template(200, content_type)
+            + b"Content-Length: %d\r\n" % st.st_size
+            + (self._validator_headers(etag, st.st_mtime)
+               + self._encoding_headers(content_type, None)).encode('latin-1')
+        )
+        return IndexEntry(file_path, real_path, st, content_type, etag, header_prefix)
+    
+    def serve_single_file(self, client_socket, file_path, request_headers=None, st=None,
+                          index_entry=None, content_type=None):
+        if index_entry is not None:
+            content_type = index_entry.content_type
+        elif content_type is None:
+            content_type = self.get_content_type(file_path)
+        
+        if content_type is None:
+            self.send_error_response(client_socket, 404, "Not Found")
+            return
+        
+        if st is None:
+            try:
+                st = os.stat(file_path)
+            except Exception as e:
+                self.access_log.message(f"[Server] Error reading file {file_path}: {e}")
+                self.send_error_response(client_socket, 500, "Internal Server Error")
+                return
+        
+        # Ranges always address the identity representation.
+        encoding = None
+        if not (request_headers and 'range' in request_headers):
+            encoding = self._negotiate_encoding(request_headers, content_type)
+        
+        if encoding is not None:
+            precompressed_path = self._precompressed_path(file_path, encoding, st)
+            if precompressed_path is not None:
+                self._serve_variant_file(client_socket, file_path, precompressed_path,
+                                         content_type, encoding, request_headers,
+                                         origin_st=st)
+                return
+            if st.st_size <= MAX_COMPRESS_SIZE:
+                self._serve_compressed(client_socket, file_path, content_type,
+                                       encoding, st, request_headers)
+                return
+        
+        self._serve_variant_file(client_socket, file_path, file_path,
+                                 content_type, None, request_headers, st, index_entry)
+    
+    def _serve_variant_file(self, client_socket, file_path, source_path,
+                            content_type, encoding, request_headers, st=None,
+                            index_entry=None, origin_st=None):
+        """
+        Send source_path as-is: the file itself or a precompressed sibling.
+        For a sibling, origin_st is the stat of file_path, which a cached
+        copy is also revalidated against.
+        """
+        if st is None:
+            try:
+                st = os.stat(source_path)
+            except Exception as e:
+                self.access_log.message(f"[Server] Error reading file {source_path}: {e}")
+                self.send_error_response(client_socket, 500, "Internal Server Error")
+                return
+        
+        checked_st = st
+        try:
+            f = open(source_path, 'rb')
+            st = os.fstat(f.fileno())
+        except FileNotFoundError:
+            # Deleted since it was indexed or its stat result was cached.
+            self.send_error_response(client_socket, 404, "Not Found")
+            return
+        except Exception as e:
+            self.access_log.message(f"[Server] Error reading file {source_path}: {e}")
+            self.send_error_response(client_socket, 500, "Internal Server Error")
+            return
         
-        try:
-            if self.enable_rate_limiting:
-                if not self._check_rate_limit(client_ip):
-                    with self.stats_lock:
-                        self.blocked_requests += 1
-                    self.send_error_response(client_socket, 429, "Too Many Requests")
-                    print(f"[{client_ip}] RATE LIMITED")
-                    return
-            
-            with self.stats_lock:
-                self.total_requests += 1
-            
-            if self.simulate_work_delay > 0:
-                time.sleep(self.simulate_work_delay)
-            
-            request_data = client_socket.recv(1024).decode('utf-8')
-            
-            if not request_data:
+        with f:
+            if self._escaped_root(source_path, checked_st, st):
+                self.send_error_response(client_socket, 403, "Forbidden")
                 return
             
-            request_lines = request_data.split('\n')
-            request_line = request_lines[0].strip()
-            
-            parts = request_line.split(' ')
-            if len(parts) < 2:
-                self.send_error_response(client_socket, 400, "Bad Request")
+            # Revalidate against the fresh fstat: the indexed or cached stat
+            # result may predate a rewrite, and answering 304 from it would
+            # pin the client to the old contents.
+            etag = self._make_etag(st)
+            if self._is_not_modified(request_headers, etag, st.st_mtime):
+                self.send_not_modified(client_socket, etag, st.st_mtime)
                 return
             
-            method = parts[0]
-            path = parts[1]
+            ranges = None
+            if encoding is None:
+                ranges = self._requested_ranges(request_headers, etag, st)
+            extra_headers = self._encoding_headers(content_type, encoding)
             
-            if method != 'GET':
-                self.send_error_response(client_socket, 405, "Method Not Allowed")
+            if (ranges is None and self.response_cache is not None
+                    and st.st_size <= self.response_cache.max_file_size):
+                body = f.read()
+                origin = None
+                if origin_st is not None:
+                    origin = (file_path, origin_st.st_mtime, origin_st.st_size)
+                self._send_and_cache(client_socket, (file_path, encoding), source_path, st,
+                                     content_type, body, etag, extra_headers,
+                                     cacheable=len(body) == st.st_size, origin=origin)
                 return
             
-            self.serve_file(client_socket, path, client_ip)
-            
-            elapsed = time.time() - start_time
-            print(f"[{client_ip}] {method} {path} - {elapsed:.3f}s")
-            
+            mapped = self._acquire_mapping(client_socket, source_path, f, st)
+            body_source = mapped or f
+            try:
+                if ranges is not None:
+                    self.send_range_response(client_socket, content_type, body_source, st,
+                                             ranges, etag)
+                elif index_entry is not None and index_entry.etag == etag:
+                    client_socket.sendall(index_entry.header_prefix
+                                          + self._connection_headers(client_socket))
+                    self._send_file_body(client_socket, body_source, 0, st.st_size)
+                else:
+                    self.send_file_response(client_socket, 200, content_type, body_source,
+                                            st.st_size,
+                                            self._validator_headers(etag, st.st_mtime)
+                                            + extra_headers)
+            finally:
+                if mapped is not None:
+                    self.mapped_files.release(mapped)
+    
+    def _acquire_mapping(self, client_socket, path, file_obj, st):
+        # The asyncio engine sends after routing returns, when the mapping
+        # may already be released, so it keeps using loop.sendfile.
+        if self.mapped_files is None or not isinstance(client_socket, ClientConnection):
+            return None
+        try:
+            return self.mapped_files.acquire(path, file_obj, st)
+        except (OSError, ValueError) as e:
+            self.access_log.message(f"[Server] Error mapping file {path}: {e}")
+            return None
+    
+    def _serve_compressed(self, client_socket, file_path, content_type, encoding, st,
+                          request_headers):
+        """Compress a text file on the fly; the result is kept in the response cache."""
+        # Validators come from the fstat of the opened file, never from a
+        # possibly stale indexed or cached stat result.
+        checked_st = st
+        data = None
+        try:
+            with open(file_path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                escaped = self._escaped_root(file_path, checked_st, st)
+                etag = self._make_etag(st, encoding)
+                if not escaped and not self._is_not_modified(request_headers, etag,
+                                                             st.st_mtime):
+                    data = f.read()
         except Exception as e:
-            print(f"[{client_ip}] Error: {e}")
+            self.access_log.message(f"[Server] Error reading file {file_path}: {e}")
+            self.send_error_response(client_socket, 500, "Internal Server Error")
+            return
+        
+        if escaped:
+            self.send_error_response(client_socket, 403, "Forbidden")
+            return
+        
+        if data is None:
+            self.send_not_modified(client_socket, etag, st.st_mtime)
+            return
+        
+        self._send_and_cache(client_socket, (file_path, encoding), file_path, st,
+                             content_type, self._compress(data, encoding), etag,
+                             self._encoding_headers(content_type, encoding),
+                             cacheable=len(data) == st.st_size)
+    
+    def _send_and_cache(self, client_socket, cache_key, file_path, st, content_type, body,
+                        etag, extra_headers="", cacheable=True, origin=None):
+        header_prefix = (
+            self._header_template(200, content_type)
+            + b"Content-Length: %d\r\n" % len(body)
+            + (self._validator_headers(etag, st.st_mtime) + extra_headers).encode('latin-1')
+        )
+        
+        entry = CacheEntry(file_path, st.st_mtime, st.st_size, header_prefix, body, etag,
+                           origin)
+        if cacheable and self.response_cache is not None:
+            self.response_cache.put(cache_key, entry)
+        self.send_cached_response(client_socket, entry)
+    
+    def _is_compressible(self, content_type):
+        # PNG and PDF are already compressed; only text benefits.
+        if content_type is None:
+            return False
+        return content_type.startswith('text/') or content_type == 'application/json'
+    
+    def _negotiate_encoding(self, request_headers, content_type):
+        """Pick the best content coding the client accepts, or None for identity."""
+        if not request_headers or not self._is_compressible(content_type):
+            return None
+        
+        accepted = {}
+        for item in request_headers.get('accept-encoding', '').split(','):
+            coding, _, params = item.strip().partition(';')
+            coding = coding.strip().lower()
+            if not coding:
+                continue
+            quality = 1.0
+            params = params.strip()
+            if params.startswith('q='):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[coding] = quality
+        
+        available = ['br', 'gzip'] if brotli is not None else ['gzip']
+        for coding in available:
+            if accepted.get(coding, accepted.get('*', 0.0)) > 0:
+                return coding
+        return None
+    
+    def _precompressed_path(self, file_path, encoding, st):
+        """Return a fresh .gz/.br sibling of file_path, if one exists on disk."""
+        sibling = file_path + ('.br' if encoding == 'br' else '.gz')
+        try:
+            sibling_st = os.stat(sibling)
+        except OSError:
+            return None
+        if sibling_st.st_mtime < st.st_mtime:
+            return None
+        # The sibling is opened directly, so it gets its own traversal check.
+        real_sibling = os.path.realpath(sibling)
+        if not self._within_root(real_sibling):
+            return None
+        return real_sibling
+    
+    def _escaped_root(self, path, checked_st, opened_st):
+        """
+        A different inode than the one checked means the path was swapped
+        (possibly a directory replaced by a symlink), so the cached
+        traversal verdict no longer applies and the check is redone.
+        """
+        if (opened_st.st_dev, opened_st.st_ino) == (checked_st.st_dev, checked_st.st_ino):
+            return False
+        return not self._within_root(path)
+    
+    def _within_root(self, path):
+        real_path = os.path.realpath(path)
+        return (real_path == self.real_serve_directory
+                or real_path.startswith(self.real_serve_directory + os.sep))
+    
+    def _compress(self, data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=6)
+        return gzip.compress(data, compresslevel=6)
+    
+    def _encoding_headers(self, content_type, encoding):
+        if not self._is_compressible(content_type):
+            return ""
+        if encoding is None:
+            return "Vary: Accept-Encoding\r\n"
+        return f"Content-Encoding: {encoding}\r\nVary: Accept-Encoding\r\n"
+    
+    def _make_etag(self, st, encoding=None):
+        if encoding is not None:
+            return f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}-{encoding}"'
+        return f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+    
+    def _validator_headers(self, etag, mtime):
+        return (f"ETag: {etag}\r\n"
+                f"Last-Modified: {formatdate(mtime, usegmt=True)}\r\n"
+                "Accept-Ranges: bytes\r\n")
+    
+    def _is_not_modified(self, request_headers, etag, mtime):
+        """Evaluate If-None-Match / If-Modified-Since against a file's validators."""
+        if not request_headers:
+            return False
+        
+        if_none_match = request_headers.get('if-none-match')
+        if if_none_match is not None:
+            # If-None-Match takes precedence; weak comparison is fine for GET.
+            if if_none_match.strip() == '*':
+                return True
+            for tag in if_none_match.split(','):
+                tag = tag.strip()
+                if tag.startswith('W/'):
+                    tag = tag[2:]
+                if tag == etag:
+                    return True
+            return False
+        
+        if_modified_since = request_headers.get('if-modified-since')
+        if if_modified_since is not None:
             try:
-                self.send_error_response(client_socket, 500, "Internal Server Error")
-            except:
-                pass
-        finally:
-            client_socket.close()
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError, IndexError):
+                return False
+            return int(mtime) <= since
+        
+        return False
     
-    def _check_rate_limit(self, client_ip):
+    def _requested_ranges(self, request_headers, etag, st):
         """
-        Check if client IP is within rate limit.
-        Thread-safe implementation.
+        Work out which byte ranges of a file the client asked for.
         
         Returns:
-            True if request allowed, False if rate limited
+            None to send the whole file, an empty list if no range can be
+            satisfied (416), or a list of inclusive (start, end) pairs
         """
-        current_time = time.time()
+        if not request_headers or 'range' not in request_headers:
+            return None
         
-        with self.rate_limit_lock:
-            timestamps = self.ip_requests[client_ip]
-            
-            timestamps = [ts for ts in timestamps if current_time - ts < 1.0]
-            
-            if len(timestamps) >= self.rate_limit:
-                return False
-            
-            timestamps.append(current_time)
-            self.ip_requests[client_ip] = timestamps
-            
-            return True
-    
-    def _increment_counter(self, path):
-
-        if self.use_locks:
-            with self.counter_lock:
-                current_value = self.request_counter[path]
-                time.sleep(0.002) 
-                self.request_counter[path] = current_value + 1
-        else:
-            current_value = self.request_counter[path]
-            time.sleep(0.002)
-            self.request_counter[path] = current_value + 1
+        if_range = request_headers.get('if-range')
+        if if_range is not None:
+            if_range = if_range.strip()
+            if if_range.startswith('"') or if_range.startswith('W/'):
+                if if_range != etag:
+                    return None
+            elif if_range != formatdate(st.st_mtime, usegmt=True):
+                return None
+        
+        return self._parse_range_header(request_headers['range'], st.st_size)
     
-    def serve_file(self, client_socket, requested_path, client_ip):
-        """Serve a file or directory listing."""
-        if requested_path.startswith('/'):
-            requested_path = requested_path[1:]
+    def _parse_range_header(self, range_header, file_size):
+        unit, _, range_set = range_header.partition('=')
+        if unit.strip().lower() != 'bytes' or not range_set.strip():
+            return None
         
-        if not requested_path:
-            requested_path = '.'
+        specs = range_set.split(',')
+        if len(specs) > MAX_RANGES:
+            return None
         
-        self._increment_counter(requested_path)
+        ranges = []
+        for spec in specs:
+            first, dash, last = spec.strip().partition('-')
+            if not dash:
+                return None
+            try:
+                if not first:
+                    suffix_length = int(last)
+                    if suffix_length <= 0:
+                        continue
+                    start = max(0, file_size - suffix_length)
+                    end = file_size - 1
+                else:
+                    start = int(first)
+                    end = int(last) if last else file_size - 1
+                    if last and end < start:
+                        return None
+                    end = min(end, file_size - 1)
+            except ValueError:
+                return None
+            
+            if start < file_size:
+                ranges.append((start, end))
         
-        file_path = os.path.join(self.serve_directory, requested_path)
+        return ranges
+    
+    def serve_directory_listing(self, client_socket, dir_path, requested_path,
+                                request_headers=None, query=None):
+        """
+        Send a directory listing.
         
+        Query parameters: format=json for a JSON listing, offset/limit for
+        one page of entries, stream=1 to send entries in scandir order with
+        chunked encoding as the directory is read (HTTP/1.1 clients of the
+        threads engine only).
+        """
+        client_socket.route = 'listing'
+        query = query or {}
         try:
-            real_file_path = os.path.realpath(file_path)
-            real_serve_dir = os.path.realpath(self.serve_directory)
-            
-            if not real_file_path.startswith(real_serve_dir):
-                self.send_error_response(client_socket, 403, "Forbidden")
-                return
-        except:
+            offset = int(query.get('offset', ['0'])[0])
+            limit = query.get('limit', [None])[0]
+            limit = int(limit) if limit is not None else None
+        except ValueError:
             self.send_error_response(client_socket, 400, "Bad Request")
             return
-        
-        if not os.path.exists(file_path):
-            self.send_error_response(client_socket, 404, "Not Found")
+        if offset < 0 or (limit is not None and limit < 0):
+            self.send_error_response(client_socket, 400, "Bad Request")
             return
         
-        if os.path.isdir(file_path):
-            self.serve_directory_listing(client_socket, file_path, requested_path)
-        else:
-            self.serve_single_file(client_socket, file_path)
-    
-    def serve_single_file(self, client_socket, file_path):
-        content_type = self.get_content_type(file_path)
+        as_json = query.get('format', ['html'])[0] == 'json'
         
-        if content_type is None:
-            self.send_error_response(client_socket, 404, "Not Found")
+        # HTTP/1.0 has no chunked encoding; those clients get the buffered
+        # listing. So does the asyncio engine: it collects every chunk until
+        # routing returns, which would give neither bounded memory nor early
+        # bytes, only the larger chunked encoding.
+        wants_stream = query.get('stream', ['0'])[0] in ('1', 'true')
+        if (wants_stream and client_socket.supports_chunked
+                and isinstance(client_socket, ClientConnection)):
+            self._stream_directory_listing(client_socket, dir_path, requested_path,
+                                           offset, limit, as_json)
             return
         
         try:
-            if content_type.startswith('text/'):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    file_content = f.read()
-                self.send_response(client_socket, 200, content_type, file_content)
+            template = self._get_listing_template(dir_path, requested_path)
+            
+            if as_json:
+                content_type = "application/json"
+                request_counts = self._request_counts()
+                body = json.dumps({
+                    'path': '/' + requested_path if requested_path != '.' else '/',
+                    'offset': offset,
+                    'limit': limit,
+                    'total': len(template.entries),
+                    'entries': [
+                        self._listing_entry_dict(requested_path, name, is_dir, request_counts)
+                        for name, is_dir in self._page(template.entries, offset, limit)
+                    ]
+                }).encode('utf-8')
             else:
-                with open(file_path, 'rb') as f:
-                    file_content = f.read()
-                self.send_binary_response(client_socket, 200, content_type, file_content)
+                content_type = HTML_CONTENT_TYPE
+                if offset or limit is not None:
+                    template = self._build_listing_template(
+                        requested_path, self._page(template.entries, offset, limit),
+                        template.mtime_ns, page=(offset, limit, len(template.entries))
+                    )
+                stats = {
+                    'total': self.total_requests - 1,
+                    'blocked': self.blocked_requests,
+                    'queue': self._queue_size()
+                }
+                body = template.render(stats, self._request_counts())
+            
+            encoding = self._negotiate_encoding(request_headers, content_type)
+            if encoding is not None:
+                body = self._compress(body, encoding)
+            self.send_binary_response(client_socket, 200, content_type, body,
+                                      self._encoding_headers(content_type, encoding))
         except Exception as e:
-            print(f"[Server] Error reading file {file_path}: {e}")
+            self.access_log.message(f"[Server] Error creating directory listing: {e}")
             self.send_error_response(client_socket, 500, "Internal Server Error")
     
-    def serve_directory_listing(self, client_socket, dir_path, requested_path):
+    def _page(self, entries, offset, limit):
+        if limit is None:
+            return entries[offset:]
+        return entries[offset:offset + limit]
+    
+    def _listing_url(self, requested_path, name):
+        if requested_path == '.':
+            return name
+        return f"{requested_path}/{name}"
+    
+    def _listing_entry_dict(self, requested_path, name, is_dir, request_counts):
+        url_path = self._listing_url(requested_path, name)
+        return {
+            'name': name,
+            'type': 'directory' if is_dir else 'file',
+            'url': f"/{url_path}/" if is_dir else f"/{url_path}",
+            'requests': request_counts.get(url_path, 0)
+        }
+    
+    def _stream_directory_listing(self, client_socket, dir_path, requested_path,
+                                  offset, limit, as_json):
+        """
+        Send a listing with chunked encoding while os.scandir walks the directory.
+        
+        Entries come out in directory order, so memory stays bounded and the
+        first bytes are sent before the whole directory has been read. Only
+        used on a ClientConnection, which writes straight to the socket.
+        """
+        content_type = "application/json" if as_json else HTML_CONTENT_TYPE
         try:
-            entries = os.listdir(dir_path)
-            entries.sort()
+            it = os.scandir(dir_path)
+        except Exception as e:
+            self.access_log.message(f"[Server] Error creating directory listing: {e}")
+            self.send_error_response(client_socket, 500, "Internal Server Error")
+            return
+        
+        client_socket.sendall(self._header_template(200, content_type)
+                              + b"Transfer-Encoding: chunked\r\n"
+                              + self._connection_headers(client_socket))
+        
+        request_counts = self._request_counts()
+        title = '/' + requested_path if requested_path != '.' else '/'
+        pending = []
+        pending_size = 0
+        
+        def write(text):
+            nonlocal pending_size
+            pending.append(text.encode('utf-8'))
+            pending_size += len(pending[-1])
+            if pending_size >= FILE_CHUNK_SIZE:
+                flush()
+        
+        def flush():
+            nonlocal pending_size
+            if pending_size:
+                data = b''.join(pending)
+                client_socket.sendall(b'%x\r\n' % len(data) + data + b'\r\n')
+                pending.clear()
+                pending_size = 0
+        
+        with it:
+            if as_json:
+                write('{"path": %s, "offset": %d, "limit": %s, "entries": [' % (
+                    json.dumps(title), offset, json.dumps(limit)))
+            else:
+                write(f"<!DOCTYPE html>\n<html>\n<head>\n    <title>Directory listing for {title}</title>\n"
+                      f"</head>\n<body>\n    <h1>Directory: {title}</h1>\n    <table>\n"
+                      f"        <tr><th>Name</th><th>Type</th><th>Requests</th></tr>\n")
             
-            lock_status = "THREAD-SAFE" if self.use_locks else "RACE CONDITION"
+            sent = 0
+            for index, entry in enumerate(it):
+                if index < offset:
+                    continue
+                if limit is not None and sent >= limit:
+                    break
+                
+                item = self._listing_entry_dict(requested_path, entry.name, entry.is_dir(),
+                                                request_counts)
+                if as_json:
+                    write((', ' if sent else '') + json.dumps(item))
+                else:
+                    write(f'        <tr><td><a href="{item["url"]}">{item["name"]}</a></td>'
+                          f'<td>{item["type"].capitalize()}</td><td>{item["requests"]}</td></tr>\n')
+                sent += 1
             
-            html_content = f"""<!DOCTYPE html>
+            write(']}' if as_json else "    </table>\n</body>\n</html>")
+        
+        flush()
+        client_socket.sendall(b'0\r\n\r\n')
+    
+    def _get_listing_template(self, dir_path, requested_path):
+        """Return the cached listing for a directory, rebuilding it if its mtime changed."""
+        cache_key = (dir_path, requested_path)
+        mtime_ns = os.stat(dir_path).st_mtime_ns
+        
+        template = self.listing_cache.get(cache_key, mtime_ns)
+        if template is None:
+            with os.scandir(dir_path) as it:
+                entries = sorted((entry.name, entry.is_dir()) for entry in it)
+            template = self._build_listing_template(requested_path, entries, mtime_ns)
+            self.listing_cache.put(cache_key, template)
+        return template
+    
+    def _build_listing_template(self, requested_path, entries, mtime_ns, page=None):
+        lock_status = "THREAD-SAFE" if self.use_locks else "RACE CONDITION"
+        template = ListingTemplate(mtime_ns, entries)
+        
+        template.text(f"""<!DOCTYPE html>
 <html>
 <head>
     <title>Directory listing for /{requested_path}</title>
@@ -311,9 +2460,15 @@ class HTTPFileServer:
         </h1>
         
         <div class="stats">
-            <div class="stats-item"><strong>Total Requests:</strong> {self.total_requests - 1}</div>
-            <div class="stats-item"><strong>Blocked:</strong> {self.blocked_requests}</div>
-            <div class="stats-item"><strong>Queue:</strong> {self.thread_pool.get_queue_size()}</div>
+            <div class="stats-item"><strong>Total Requests:</strong> """)
+        template.slot('stat', 'total')
+        template.text("""</div>
+            <div class="stats-item"><strong>Blocked:</strong> """)
+        template.slot('stat', 'blocked')
+        template.text("""</div>
+            <div class="stats-item"><strong>Queue:</strong> """)
+        template.slot('stat', 'queue')
+        template.text("""</div>
         </div>
         
         <table>
@@ -322,109 +2477,299 @@ class HTTPFileServer:
                 <th>Type</th>
                 <th>Requests</th>
             </tr>
-"""
-            
-            # Parent directory
-            if requested_path != '.':
-                parent_path = os.path.dirname(requested_path) if requested_path != '.' else ''
-                parent_count = self.request_counter.get(parent_path, 0)
-                html_content += f"""
+""")
+        
+        # Parent directory
+        if requested_path != '.':
+            parent_path = os.path.dirname(requested_path)
+            template.text(f"""
             <tr>
                 <td><a href="/{parent_path}" class="directory"> ../</a></td>
                 <td>Directory</td>
-                <td><span class="count">{parent_count}</span></td>
+                <td><span class="count">""")
+            template.slot('count', parent_path)
+            template.text("""</span></td>
             </tr>
-"""
+""")
+        
+        # Entries
+        for entry, is_dir in entries:
+            url_path = self._listing_url(requested_path, entry)
             
-            # Entries
-            for entry in entries:
-                entry_path = os.path.join(dir_path, entry)
-                if requested_path == '.':
-                    url_path = entry
-                else:
-                    url_path = f"{requested_path}/{entry}"
-                
-                count = self.request_counter.get(url_path, 0)
-                
-                if os.path.isdir(entry_path):
-                    html_content += f"""
+            if is_dir:
+                template.text(f"""
             <tr>
                 <td><a href="/{url_path}/" class="directory"> {entry}</a></td>
                 <td>Directory</td>
-                <td><span class="count">{count}</span></td>
-            </tr>
-"""
-                else:
-                    html_content += f"""
+                <td><span class="count">""")
+            else:
+                template.text(f"""
             <tr>
                 <td><a href="/{url_path}"> {entry}</a></td>
                 <td>File</td>
-                <td><span class="count">{count}</span></td>
+                <td><span class="count">""")
+            template.slot('count', url_path)
+            template.text("""</span></td>
             </tr>
-"""
-            
-            html_content += """
+""")
+        
+        template.text("""
         </table>
-        <p style="color: #666; margin-top: 20px; font-size: 12px;">
+""")
+        
+        if page is not None:
+            offset, limit, total = page
+            shown_to = offset + len(entries)
+            links = []
+            if offset > 0:
+                previous_offset = max(0, offset - (limit or offset))
+                links.append(f'<a href="?offset={previous_offset}&limit={limit or offset}">&laquo; Previous</a>')
+            if shown_to < total:
+                links.append(f'<a href="?offset={shown_to}&limit={limit or total}">Next &raquo;</a>')
+            template.text(f"""        <p>Entries {offset + 1 if entries else offset}-{shown_to} of {total} {' '.join(links)}</p>
+""")
+        
+        template.text("""        <p style="color: #666; margin-top: 20px; font-size: 12px;">
             Lab 2: Multithreaded HTTP Server with Thread Pool
         </p>
     </div>
 </body>
-</html>"""
-            
-            self.send_response(client_socket, 200, "text/html", html_content)
-        except Exception as e:
-            print(f"[Server] Error creating directory listing: {e}")
-            self.send_error_response(client_socket, 500, "Internal Server Error")
+</html>""")
+        template.finish()
+        return template
+    
+    def serve_metrics(self, client_socket):
+        """Expose latency histograms and pool/server gauges in Prometheus text format."""
+        stats = self.get_statistics()
+        lines = [
+            "# HELP http_request_duration_seconds Request latency by route class and phase.",
+            "# TYPE http_request_duration_seconds histogram"
+        ]
+        lines += self.request_latency.render_prometheus(
+            'http_request_duration_seconds', ('route', 'phase'))
+        
+        lines += [
+            "# HELP http_requests_total Requests accepted for processing.",
+            "# TYPE http_requests_total counter",
+            f"http_requests_total {stats['total_requests']}",
+            "# HELP http_requests_blocked_total Requests rejected by the rate limiter.",
+            "# TYPE http_requests_blocked_total counter",
+            f"http_requests_blocked_total {stats['blocked_requests']}",
+            "# HELP http_connections_shed_total Connections turned away because the queue was full.",
+            "# TYPE http_connections_shed_total counter",
+            f"http_connections_shed_total {stats['shed_connections']}",
+            "# HELP access_log_dropped_total Access log records dropped because the buffer was full.",
+            "# TYPE access_log_dropped_total counter",
+            f"access_log_dropped_total {stats['access_log']['dropped']}"
+        ]
+        
+        pool = stats['thread_pool']
+        if pool is not None:
+            lines += [
+                "# HELP threadpool_queue_wait_seconds Time connections wait for a worker thread.",
+                "# TYPE threadpool_queue_wait_seconds histogram"
+            ]
+            lines += self.thread_pool.queue_wait_histogram.render_prometheus(
+                'threadpool_queue_wait_seconds', ())
+            lines += [
+                "# TYPE threadpool_queue_depth gauge",
+                f"threadpool_queue_depth {pool['queue_size']}",
+                "# TYPE threadpool_workers gauge",
+                f"threadpool_workers {pool['workers']}",
+                "# TYPE threadpool_active_workers gauge",
+                f"threadpool_active_workers {pool['workers'] - pool['idle_workers']}",
+                "# TYPE threadpool_tasks_completed_total counter",
+                f"threadpool_tasks_completed_total {pool['tasks_completed']}"
+            ]
+        
+        cache = stats['cache']
+        if cache is not None:
+            lines += [
+                "# TYPE response_cache_hits_total counter",
+                f"response_cache_hits_total {cache['hits']}",
+                "# TYPE response_cache_misses_total counter",
+                f"response_cache_misses_total {cache['misses']}",
+                "# TYPE response_cache_evictions_total counter",
+                f"response_cache_evictions_total {cache['evictions']}",
+                "# TYPE response_cache_bytes gauge",
+                f"response_cache_bytes {cache['bytes']}"
+            ]
+        
+        body = ('\n'.join(lines) + '\n').encode('utf-8')
+        self.send_binary_response(client_socket, 200, "text/plain; version=0.0.4; charset=utf-8", body)
     
     def get_content_type(self, file_path):
         extension = os.path.splitext(file_path)[1].lower()
+        return MIME_TYPES.get(extension)
+    
+    def send_response(self, client_socket, status_code, content_type, body):
+        self.send_binary_response(client_socket, status_code, content_type, body.encode('utf-8'))
+    
+    def send_binary_response(self, client_socket, status_code, content_type, body_bytes,
+                             extra_headers=""):
+        head = self._header_template(status_code, content_type)
+        head += b"Content-Length: %d\r\n" % len(body_bytes)
+        if extra_headers:
+            head += extra_headers.encode('latin-1')
+        head += self._connection_headers(client_socket)
+        self._send_buffers(client_socket, [head, body_bytes])
+    
+    def send_file_response(self, client_socket, status_code, content_type, file_obj, file_size,
+                           extra_headers=""):
+        head = self._header_template(status_code, content_type)
+        head += b"Content-Length: %d\r\n" % file_size
+        if extra_headers:
+            head += extra_headers.encode('latin-1')
+        head += self._connection_headers(client_socket)
         
-        mime_types = {
-            '.html': 'text/html',
-            '.htm': 'text/html',
-            '.png': 'image/png',
-            '.pdf': 'application/pdf',
-            '.txt': 'text/plain'
-        }
+        client_socket.sendall(head)
+        self._send_file_body(client_socket, file_obj, 0, file_size)
+    
+    def send_range_response(self, client_socket, content_type, file_obj, st, ranges, etag):
+        file_size = st.st_size
+        
+        if not ranges:
+            client_socket.sendall(
+                STATUS_LINES[416]
+                + f"Content-Range: bytes */{file_size}\r\n".encode('latin-1')
+                + b"Content-Length: 0\r\n"
+                + self._connection_headers(client_socket)
+            )
+            return
+        
+        response_headers = self._validator_headers(etag, st.st_mtime)
+        
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            response_headers += f"Content-Type: {content_type}\r\n"
+            response_headers += f"Content-Range: bytes {start}-{end}/{file_size}\r\n"
+            response_headers += f"Content-Length: {end - start + 1}\r\n"
+            
+            client_socket.sendall(STATUS_LINES[206] + response_headers.encode('latin-1')
+                                  + self._connection_headers(client_socket))
+            self._send_file_body(client_socket, file_obj, start, end - start + 1)
+            return
+        
+        # Several ranges go out as multipart/byteranges; each part header is
+        # built up front so Content-Length is known before any data is sent.
+        boundary = os.urandom(12).hex()
+        part_headers = [
+            (f"\r\n--{boundary}\r\n"
+             f"Content-Type: {content_type}\r\n"
+             f"Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n").encode('latin-1')
+            for start, end in ranges
+        ]
+        closing = f"\r\n--{boundary}--\r\n".encode('latin-1')
+        content_length = (sum(len(header) for header in part_headers)
+                          + sum(end - start + 1 for start, end in ranges)
+                          + len(closing))
         
-        return mime_types.get(extension)
+        response_headers += f"Content-Type: multipart/byteranges; boundary={boundary}\r\n"
+        response_headers += f"Content-Length: {content_length}\r\n"
+        
+        client_socket.sendall(STATUS_LINES[206] + response_headers.encode('latin-1')
+                              + self._connection_headers(client_socket))
+        for part_header, (start, end) in zip(part_headers, ranges):
+            client_socket.sendall(part_header)
+            self._send_file_body(client_socket, file_obj, start, end - start + 1)
+        client_socket.sendall(closing)
     
-    def send_response(self, client_socket, status_code, content_type, body):
-        status_text = self.get_status_text(status_code)
-        response_headers = f"HTTP/1.1 {status_code} {status_text}\r\n"
-        response_headers += f"Content-Type: {content_type}\r\n"
-        response_headers += f"Content-Length: {len(body.encode('utf-8'))}\r\n"
-        response_headers += "Connection: close\r\n\r\n"
+    def send_not_modified(self, client_socket, etag, mtime):
+        client_socket.sendall(STATUS_LINES[304]
+                              + self._validator_headers(etag, mtime).encode('latin-1')
+                              + self._connection_headers(client_socket))
+    
+    def send_cached_response(self, client_socket, entry):
+        self._send_buffers(client_socket, [
+            entry.header_prefix + self._connection_headers(client_socket),
+            entry.body
+        ])
+    
+    def _send_buffers(self, client_socket, buffers):
+        """
+        Write headers and body with one vectored sendmsg where the
+        connection supports it, so the body is never copied just to be
+        joined to its headers.
+        """
+        sendmsg = getattr(client_socket, 'sendmsg', None)
+        if sendmsg is None or not hasattr(socket.socket, 'sendmsg'):
+            for buffer in buffers:
+                if buffer:
+                    client_socket.sendall(buffer)
+            return
         
-        response = response_headers + body
-        client_socket.send(response.encode('utf-8'))
+        views = [memoryview(buffer) for buffer in buffers if buffer]
+        while views:
+            sent = sendmsg(views)
+            while views and sent >= len(views[0]):
+                sent -= len(views[0])
+                views.pop(0)
+            if sent:
+                views[0] = views[0][sent:]
     
-    def send_binary_response(self, client_socket, status_code, content_type, body_bytes):
-        status_text = self.get_status_text(status_code)
-        response_headers = f"HTTP/1.1 {status_code} {status_text}\r\n"
-        response_headers += f"Content-Type: {content_type}\r\n"
-        response_headers += f"Content-Length: {len(body_bytes)}\r\n"
-        response_headers += "Connection: close\r\n\r\n"
+    def _send_file_body(self, client_socket, file_obj, offset, count):
+        """
+        Stream part of a file to the client without loading it into memory.
         
-        client_socket.send(response_headers.encode('utf-8'))
-        client_socket.send(body_bytes)
+        Slices a shared MappedFile when one is given, uses sendfile (kernel
+        zero-copy, or the socket module's own fallback) when the connection
+        provides it, and otherwise copies through one fixed-size buffer.
+        """
+        if count <= 0:
+            return
+        
+        if isinstance(file_obj, MappedFile):
+            # sendall's timeout covers the whole call, so go chunk by chunk
+            # to keep it an idle timeout like the sendfile path.
+            end = offset + count
+            for start in range(offset, end, FILE_CHUNK_SIZE):
+                with file_obj.view[start:min(start + FILE_CHUNK_SIZE, end)] as chunk:
+                    client_socket.sendall(chunk)
+            return
+        
+        if hasattr(client_socket, 'sendfile'):
+            client_socket.sendfile(file_obj, offset, count)
+            return
+        
+        file_obj.seek(offset)
+        buffer = memoryview(bytearray(FILE_CHUNK_SIZE))
+        remaining = count
+        while remaining > 0:
+            read = file_obj.readinto(buffer[:min(remaining, FILE_CHUNK_SIZE)])
+            if not read:
+                break
+            client_socket.sendall(buffer[:read])
+            remaining -= read
+    
+    def _connection_headers(self, client_socket):
+        if getattr(client_socket, 'keep_alive', False):
+            return self._keep_alive_headers
+        return self._close_headers
+    
+    def _header_template(self, status_code, content_type):
+        """Encoded status line plus Content-Type, built once per pair."""
+        key = (status_code, content_type)
+        template = self._header_templates.get(key)
+        if template is None:
+            template = STATUS_LINES.get(status_code) or (
+                f"HTTP/1.1 {status_code} {self.get_status_text(status_code)}\r\n"
+            ).encode('latin-1')
+            template += f"Content-Type: {content_type}\r\n".encode('latin-1')
+            self._header_templates[key] = template
+        return template
     
     def send_error_response(self, client_socket, status_code, status_text):
+        client_socket.route = 'error'
         body = f"<html><body><h1>{status_code} {status_text}</h1></body></html>"
-        self.send_response(client_socket, status_code, "text/html", body)
+        self.send_response(client_socket, status_code, HTML_CONTENT_TYPE, body)
     
     def get_status_text(self, status_code):
-        status_texts = {
-            200: "OK",
-            400: "Bad Request",
-            403: "Forbidden",
-            404: "Not Found",
-            405: "Method Not Allowed",
-            429: "Too Many Requests",
-            500: "Internal Server Error"
-        }
-        return status_texts.get(status_code, "Unknown")
+        return STATUS_TEXTS.get(status_code, "Unknown")
+    
+    def _queue_size(self):
+        if self.thread_pool is None:
+            return 0
+        return self.thread_pool.get_queue_size()
     
     def get_statistics(self):
         with self.stats_lock:
@@ -432,10 +2777,27 @@ class HTTPFileServer:
                 'total_requests': self.total_requests,
                 'blocked_requests': self.blocked_requests,
                 'successful_requests': self.total_requests - self.blocked_requests,
-                'request_counter': dict(self.request_counter)
+                'request_counter': self._request_counts(),
+                'cache': (self.response_cache.get_statistics()
+                          if self.response_cache is not None else None),
+                'rate_limiter': (self.rate_limiter.get_statistics()
+                                 if self.rate_limiter is not None else None),
+                'queue_depth': self._queue_size(),
+                'thread_pool': (self.thread_pool.get_statistics()
+                                if self.thread_pool is not None else None),
+                'shed_connections': self.shed_connections,
+                'path_cache': self.path_cache.get_statistics(),
+                'content_index': (self.content_index.get_statistics()
+                                  if self.content_index is not None else None),
+                'mapped_files': (self.mapped_files.get_statistics()
+                                 if self.mapped_files is not None else None),
+                'idle_connections': (self.idle_connections.get_statistics()
+                                     if self.idle_connections is not None else None),
+                'access_log': self.access_log.get_statistics()
             }
     
     def shutdown(self):
+        self.access_log.close()
         print("\n[Server] Shutting down...")
         
         stats = self.get_statistics()
@@ -443,24 +2805,291 @@ class HTTPFileServer:
         print(f"  - Total requests: {stats['total_requests']}")
         print(f"  - Successful: {stats['successful_requests']}")
         print(f"  - Blocked: {stats['blocked_requests']}")
+        print(f"  - Shed (overload): {stats['shed_connections']}")
+        if stats['thread_pool'] is not None:
+            pool = stats['thread_pool']
+            print(f"  - Thread pool: {pool['workers']} workers "
+                  f"({pool['workers_spawned']} spawned, {pool['workers_retired']} retired), "
+                  f"avg queue wait {pool['avg_queue_wait'] * 1000:.1f}ms, "
+                  f"max {pool['max_queue_wait'] * 1000:.1f}ms")
+        if stats['rate_limiter'] is not None:
+            limiter = stats['rate_limiter']
+            print(f"  - Rate limiter: {limiter['tracked_ips']} IPs tracked, "
+                  f"{limiter['evictions']} evicted")
+        if stats['cache'] is not None:
+            cache = stats['cache']
+            print(f"  - Cache: {cache['hits']} hits, {cache['misses']} misses, "
+                  f"{cache['evictions']} evictions")
+        access_log = stats['access_log']
+        print(f"  - Access log: {access_log['logged']} written, {access_log['dropped']} dropped, "
+              f"{access_log['sampled_out']} sampled out")
         
-        self.thread_pool.shutdown()
+        if self.idle_connections is not None:
+            self.idle_connections.close()
+        if self.thread_pool is not None:
+            self.thread_pool.shutdown()
+        if self.mapped_files is not None:
+            self.mapped_files.close()
         self.server_socket.close()
         print("[Server] Shutdown complete\n")
 
+# Per-worker settings and high-water marks (and the content index, which
+# every worker builds over the same tree): the merged value is the largest.
+MERGE_MAX = {
+    ('thread_pool', 'min_workers'),
+    ('thread_pool', 'max_workers'),
+    ('thread_pool', 'max_queue_wait'),
+    ('cache', 'max_bytes'),
+    ('content_index', 'files'),
+    ('content_index', 'directories'),
+    ('content_index', 'last_scan_time')
+}
+
+# Averages: path -> the sibling count each worker's average is weighted by.
+MERGE_AVERAGE = {
+    ('thread_pool', 'avg_queue_wait'): 'tasks_completed'
+}
+
+def merge_statistics(snapshots):
+    """
+    Combine get_statistics() results from several workers into one view.
+    
+    Counters and gauges are summed, MERGE_MAX fields take the largest value
+    and MERGE_AVERAGE fields are recomputed as weighted averages.
+    """
+    merged = {}
+    for snapshot in snapshots:
+        _merge_into(merged, snapshot, ())
+    
+    for path, weight_key in MERGE_AVERAGE.items():
+        parent = merged
+        for key in path[:-1]:
+            parent = parent.get(key)
+            if not isinstance(parent, dict):
+                break
+        else:
+            if path[-1] in parent:
+                weight = parent.get(weight_key, 0)
+                parent[path[-1]] = parent[path[-1]] / weight if weight else 0.0
+    return merged
+
+def _merge_into(target, source, path):
+    for key, value in source.items():
+        key_path = path + (key,)
+        if isinstance(value, dict):
+            # A section another worker reported as None (disabled) still
+            # takes this worker's values.
+            if not isinstance(target.get(key), dict):
+                target[key] = {}
+            _merge_into(target[key], value, key_path)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            if key_path in MERGE_MAX:
+                target[key] = max(target.get(key, value), value)
+            elif key_path in MERGE_AVERAGE:
+                # Weighted sum for now; merge_statistics divides at the end.
+                weight = source.get(MERGE_AVERAGE[key_path], 0)
+                target[key] = target.get(key, 0) + value * weight
+            else:
+                target[key] = target.get(key, 0) + value
+        elif key not in target:
+            target[key] = value
+
+def _stop_worker(signum, frame):
+    # A second SIGTERM (the supervisor's terminate() after its deadline)
+    # kills outright instead of interrupting the shutdown in progress.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    raise SystemExit(0)
+
+def _run_worker(worker_id, server_kwargs, stats_queue, stats_interval):
+    # Ctrl+C reaches the whole process group; only the supervisor reacts to
+    # it, and stops the workers with SIGTERM so each one shuts down once
+    # and still reports its final statistics.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _stop_worker)
+    server = HTTPFileServer(reuse_port=True, **server_kwargs)
+    pid = os.getpid()
+    
+    def report_statistics():
+        while True:
+            time.sleep(stats_interval)
+            stats_queue.put((worker_id, pid, server.get_statistics()))
+    
+    threading.Thread(target=report_statistics, daemon=True).start()
+    
+    try:
+        server.start()
+    finally:
+        stats_queue.put((worker_id, pid, server.get_statistics()))
+
+class WorkerSupervisor:
+    """
+    Runs N server processes that share one port via SO_REUSEPORT.
+    
+    The kernel balances incoming connections across the workers; the
+    supervisor restarts any worker that dies and merges the statistics
+    each worker reports into a single view.
+    
+    A worker that dies within STABLE_UPTIME seconds of starting is restarted
+    after an exponentially growing delay, and given up on after
+    MAX_QUICK_FAILURES such crashes in a row (e.g. when it cannot bind).
+    """
+    
+    RESTART_BACKOFF = 0.5
+    MAX_RESTART_BACKOFF = 30
+    STABLE_UPTIME = 10
+    MAX_QUICK_FAILURES = 5
+    
+    def __init__(self, num_workers, server_kwargs, stats_interval=1.0):
+        self.num_workers = num_workers
+        self.server_kwargs = server_kwargs
+        self.stats_interval = stats_interval
+        
+        self.workers = {}
+        self.started_at = {}
+        self.quick_failures = defaultdict(int)
+        self.restart_at = {}
+        self.restarts = 0
+        self.is_running = True
+        
+        self.stats_queue = multiprocessing.Queue()
+        self.worker_stats = {}
+        
+        print(f"[Supervisor] Starting {num_workers} worker processes")
+    
+    def _spawn(self, worker_id):
+        process = multiprocessing.Process(
+            target=_run_worker,
+            args=(worker_id, self.server_kwargs, self.stats_queue, self.stats_interval),
+            daemon=True
+        )
+        process.start()
+        self.workers[worker_id] = process
+        self.started_at[worker_id] = time.monotonic()
+        print(f"[Supervisor] Worker-{worker_id} started (pid {process.pid})")
+    
+    def start(self):
+        """
+        Returns:
+            False if every worker kept crashing and was given up on
+        """
+        for worker_id in range(self.num_workers):
+            self._spawn(worker_id)
+        
+        try:
+            while self.is_running and self.workers:
+                self._collect_statistics(timeout=0.5)
+                
+                for worker_id, process in list(self.workers.items()):
+                    if (not process.is_alive() and self.is_running
+                            and worker_id not in self.restart_at):
+                        self._schedule_restart(worker_id, process)
+                
+                now = time.monotonic()
+                for worker_id, restart_at in list(self.restart_at.items()):
+                    if now >= restart_at and self.is_running:
+                        del self.restart_at[worker_id]
+                        self.restarts += 1
+                        self._spawn(worker_id)
+            
+            if not self.workers:
+                print("[Supervisor] All workers failed, giving up")
+        except KeyboardInterrupt:
+            print("\n[Supervisor] Keyboard interrupt received")
+        finally:
+            self.shutdown()
+        return bool(self.workers)
+    
+    def _schedule_restart(self, worker_id, process):
+        now = time.monotonic()
+        if now - self.started_at[worker_id] >= self.STABLE_UPTIME:
+            self.quick_failures[worker_id] = 0
+        else:
+            self.quick_failures[worker_id] += 1
+        failures = self.quick_failures[worker_id]
+        
+        if failures >= self.MAX_QUICK_FAILURES:
+            print(f"[Supervisor] Worker-{worker_id} (pid {process.pid}) exited with code "
+                  f"{process.exitcode} after {failures} quick failures, not restarting")
+            del self.workers[worker_id]
+            return
+        
+        delay = 0
+        if failures:
+            delay = min(self.MAX_RESTART_BACKOFF, self.RESTART_BACKOFF * 2 ** (failures - 1))
+        print(f"[Supervisor] Worker-{worker_id} (pid {process.pid}) "
+              f"exited with code {process.exitcode}, restarting in {delay:g}s")
+        self.restart_at[worker_id] = now + delay
+    
+    def _collect_statistics(self, timeout=0):
+        try:
+            while True:
+                worker_id, pid, stats = self.stats_queue.get(timeout=timeout)
+                # Keyed by pid so a restarted worker's history is kept.
+                self.worker_stats[(worker_id, pid)] = stats
+                timeout = 0
+        except queue.Empty:
+            pass
+    
+    def get_statistics(self):
+        stats = merge_statistics(self.worker_stats.values())
+        stats['workers'] = self.num_workers
+        stats['worker_restarts'] = self.restarts
+        return stats
+    
+    def shutdown(self):
+        print("\n[Supervisor] Shutting down workers...")
+        self.is_running = False
+        
+        for process in self.workers.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+        
+        deadline = time.time() + 5
+        for process in self.workers.values():
+            process.join(timeout=max(0, deadline - time.time()))
+            if process.is_alive():
+                process.terminate()
+        
+        self._collect_statistics(timeout=0.5)
+        
+        stats = self.get_statistics()
+        print(f"\n[Supervisor] Merged Statistics ({self.num_workers} workers):")
+        print(f"  - Total requests: {stats.get('total_requests', 0)}")
+        print(f"  - Successful: {stats.get('successful_requests', 0)}")
+        print(f"  - Blocked: {stats.get('blocked_requests', 0)}")
+        print(f"  - Worker restarts: {self.restarts}")
+        print("[Supervisor] Shutdown complete\n")
+
 def main():
     if len(sys.argv) < 2:
         print("Usage: python file_server_lab2.py <directory> [options]")
         print("\nOptions:")
         print("  --threads N          Number of worker threads (default: 4)")
+        print("  --max-threads N      Let the pool grow up to N threads under load (default: --threads)")
         print("  --delay N            Simulate work delay in seconds (default: 0)")
         print("  --no-locks           Disable locks (demonstrate race condition)")
         print("  --rate-limit N       Enable rate limiting (N requests/second)")
+        print("  --max-ips N          Max client IPs tracked by the rate limiter (default: 10000)")
+        print("  --keep-alive N       Keep-alive idle timeout in seconds (default: 5)")
+        print("  --max-requests N     Max requests per keep-alive connection (default: 100)")
+        print("  --cache-size N       Response cache budget in MB, 0 disables (default: 16)")
+        print("  --engine NAME        Serving engine: threads or asyncio (default: threads)")
+        print("  --backlog N          Listen backlog (default: 128)")
+        print("  --queue-size N       Max connections waiting for a thread, 0 = unbounded (default: 256)")
+        print("  --overload POLICY    When the queue is full: 503 or close (default: 503)")
+        print("  --workers N          Run N server processes sharing the port (default: 1)")
+        print("  --preindex           Index the serve directory at startup for one-lookup routing")
+        print("  --rescan N           Seconds between index rescans with --preindex (default: 5)")
+        print("  --mmap               Serve large files from shared memory mappings (threads engine)")
+        print("  --access-log FORMAT  Access log format: common, json or off (default: common)")
+        print("  --log-sample R       Fraction of requests to log, 0-1 (default: 1)")
         print("\nExamples:")
         print("  python file_server_lab2.py content/")
         print("  python file_server_lab2.py content/ --threads 4 --delay 1")
         print("  python file_server_lab2.py content/ --no-locks")
         print("  python file_server_lab2.py content/ --rate-limit 5")
+        print("  python file_server_lab2.py content/ --engine asyncio --delay 1")
+        print("  python file_server_lab2.py content/ --workers 4 --threads 8")
         sys.exit(1)
     
     serve_directory = sys.argv[1]
@@ -470,16 +3099,34 @@ def main():
         sys.exit(1)
     
     num_threads = 4
+    max_threads = None
     delay = 0
     use_locks = True
     enable_rate_limiting = False
     rate_limit = 5
+    keep_alive_timeout = 5
+    max_keep_alive_requests = 100
+    engine = 'threads'
+    cache_size = 16 * 1024 * 1024
+    num_workers = 1
+    max_tracked_ips = 10000
+    listen_backlog = 128
+    max_queue_size = 256
+    overload_policy = '503'
+    access_log_format = 'common'
+    access_log_sample = 1.0
+    use_mmap = False
+    preindex = False
+    rescan_interval = 5.0
     
     i = 2
     while i < len(sys.argv):
         if sys.argv[i] == '--threads' and i + 1 < len(sys.argv):
             num_threads = int(sys.argv[i + 1])
             i += 2
+        elif sys.argv[i] == '--max-threads' and i + 1 < len(sys.argv):
+            max_threads = int(sys.argv[i + 1])
+            i += 2
         elif sys.argv[i] == '--delay' and i + 1 < len(sys.argv):
             delay = float(sys.argv[i + 1])
             i += 2
@@ -490,21 +3137,98 @@ def main():
             enable_rate_limiting = True
             rate_limit = int(sys.argv[i + 1])
             i += 2
+        elif sys.argv[i] == '--max-ips' and i + 1 < len(sys.argv):
+            max_tracked_ips = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--keep-alive' and i + 1 < len(sys.argv):
+            keep_alive_timeout = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--max-requests' and i + 1 < len(sys.argv):
+            max_keep_alive_requests = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--engine' and i + 1 < len(sys.argv):
+            engine = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--cache-size' and i + 1 < len(sys.argv):
+            cache_size = int(float(sys.argv[i + 1]) * 1024 * 1024)
+            i += 2
+        elif sys.argv[i] == '--backlog' and i + 1 < len(sys.argv):
+            listen_backlog = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--queue-size' and i + 1 < len(sys.argv):
+            max_queue_size = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--overload' and i + 1 < len(sys.argv):
+            overload_policy = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--workers' and i + 1 < len(sys.argv):
+            num_workers = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--preindex':
+            preindex = True
+            i += 1
+        elif sys.argv[i] == '--rescan' and i + 1 < len(sys.argv):
+            rescan_interval = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--mmap':
+            use_mmap = True
+            i += 1
+        elif sys.argv[i] == '--access-log' and i + 1 < len(sys.argv):
+            access_log_format = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--log-sample' and i + 1 < len(sys.argv):
+            access_log_sample = float(sys.argv[i + 1])
+            i += 2
         else:
             i += 1
     
-    server = HTTPFileServer(
+    if engine not in ('threads', 'asyncio'):
+        print(f"Error: unknown engine '{engine}' (expected threads or asyncio)")
+        sys.exit(1)
+    
+    if overload_policy not in ('503', 'close'):
+        print(f"Error: unknown overload policy '{overload_policy}' (expected 503 or close)")
+        sys.exit(1)
+    
+    if access_log_format not in AccessLog.FORMATS:
+        print(f"Error: unknown access log format '{access_log_format}' (expected common, json or off)")
+        sys.exit(1)
+    
+    if num_workers > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+        print("Error: --workers needs SO_REUSEPORT, which this platform does not support")
+        sys.exit(1)
+    
+    server_kwargs = dict(
         serve_directory=serve_directory,
         host='0.0.0.0',
         port=8080,
         num_threads=num_threads,
+        max_threads=max_threads,
         simulate_work_delay=delay,
         use_locks=use_locks,
         enable_rate_limiting=enable_rate_limiting,
-        rate_limit=rate_limit
+        rate_limit=rate_limit,
+        max_tracked_ips=max_tracked_ips,
+        keep_alive_timeout=keep_alive_timeout,
+        max_keep_alive_requests=max_keep_alive_requests,
+        engine=engine,
+        cache_size=cache_size,
+        listen_backlog=listen_backlog,
+        max_queue_size=max_queue_size,
+        overload_policy=overload_policy,
+        access_log_format=access_log_format,
+        access_log_sample=access_log_sample,
+        use_mmap=use_mmap,
+        preindex=preindex,
+        rescan_interval=rescan_interval
     )
     
-    server.start()
+    if num_workers > 1:
+        if not WorkerSupervisor(num_workers, server_kwargs).start():
+            sys.exit(1)
+    else:
+        server = HTTPFileServer(**server_kwargs)
+        server.start()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,73 @@
+import os
+import socket
+import threading
+
+import pytest
+
+ETAG = '"1-3e8-0"'
+MTIME = 1700000000.0
+
+def fetch(server, path, headers=None):
+    """Run one request through handle_request over a socket pair."""
+    client, connection = socket.socketpair()
+    worker = threading.Thread(target=server.handle_request,
+                              args=(connection, ('127.0.0.1', 0)))
+    worker.start()
+    extra = ''.join(f'{name}: {value}\r\n' for name, value in (headers or {}).items())
+    client.sendall(f'GET {path} HTTP/1.1\r\nHost: x\r\nConnection: close\r\n{extra}\r\n'
+                   .encode('latin-1'))
+    data = b''
+    while True:
+        chunk = client.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    worker.join()
+    client.close()
+    
+    head, _, body = data.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    response_headers = dict(line.lower().split(': ', 1) for line in lines[1:])
+    return int(lines[0].split(' ')[1]), response_headers, body
+
+@pytest.mark.parametrize('headers, expected', [
+    (None, False),
+    ({}, False),
+    ({'if-none-match': ETAG}, True),
+    ({'if-none-match': 'W/' + ETAG}, True),
+    ({'if-none-match': '"other", ' + ETAG}, True),
+    ({'if-none-match': '*'}, True),
+    ({'if-none-match': '"other"'}, False),
+    ({'if-modified-since': 'Tue, 14 Nov 2023 22:13:20 GMT'}, True),
+    ({'if-modified-since': 'Tue, 14 Nov 2023 22:14:00 GMT'}, True),
+    ({'if-modified-since': 'Tue, 14 Nov 2023 22:12:00 GMT'}, False),
+    ({'if-modified-since': 'not a date'}, False),
+    # If-None-Match takes precedence over If-Modified-Since.
+    ({'if-none-match': '"other"', 'if-modified-since': 'Tue, 14 Nov 2023 22:14:00 GMT'},
+     False)
+])
+def test_is_not_modified(server, headers, expected):
+    assert server._is_not_modified(headers, ETAG, MTIME) is expected
+
+def test_rewritten_file_is_not_answered_with_304(server):
+    # Revalidate cached entries on every hit, so only the stat and path
+    # caches could still hold the old validators.
+    server.response_cache.revalidate_interval = 0
+    path = os.path.join(server.serve_directory, 'page.html')
+    with open(path, 'w') as f:
+        f.write('<p>old</p>')
+    
+    status, headers, body = fetch(server, '/page.html')
+    assert (status, body) == (200, b'<p>old</p>')
+    old_etag = headers['etag']
+    assert fetch(server, '/page.html', {'If-None-Match': old_etag})[0] == 304
+    
+    with open(path, 'w') as f:
+        f.write('<p>new</p>')
+    st = os.stat(path)
+    os.utime(path, (st.st_atime, st.st_mtime + 10))
+    
+    status, headers, body = fetch(server, '/page.html', {'If-None-Match': old_etag})
+    assert (status, body) == (200, b'<p>new</p>')
+    assert headers['etag'] != old_etag
+    assert fetch(server, '/page.html', {'If-None-Match': headers['etag']})[0] == 304
@@ -0,0 +1,48 @@
+from file_server_lab2 import merge_statistics
+
+def worker_stats(total, min_workers, max_queue_wait, avg_queue_wait, tasks_completed,
+                 cache=None):
+    return {
+        'total_requests': total,
+        'engine': 'threads',
+        'thread_pool': {
+            'min_workers': min_workers,
+            'max_queue_wait': max_queue_wait,
+            'avg_queue_wait': avg_queue_wait,
+            'tasks_completed': tasks_completed
+        },
+        'cache': cache
+    }
+
+def test_counters_are_summed():
+    merged = merge_statistics([worker_stats(10, 4, 0.1, 0.0, 0),
+                               worker_stats(15, 4, 0.1, 0.0, 0)])
+    assert merged['total_requests'] == 25
+    assert merged['engine'] == 'threads'
+
+def test_max_fields_take_the_largest_value():
+    merged = merge_statistics([worker_stats(1, 4, 0.2, 0.0, 0),
+                               worker_stats(1, 8, 0.5, 0.0, 0),
+                               worker_stats(1, 2, 0.3, 0.0, 0)])
+    assert merged['thread_pool']['min_workers'] == 8
+    assert merged['thread_pool']['max_queue_wait'] == 0.5
+
+def test_averages_are_weighted_by_task_count():
+    merged = merge_statistics([worker_stats(1, 4, 0.1, 0.010, 100),
+                               worker_stats(1, 4, 0.1, 0.040, 300)])
+    assert merged['thread_pool']['tasks_completed'] == 400
+    assert abs(merged['thread_pool']['avg_queue_wait'] - 0.0325) < 1e-12
+
+def test_average_with_no_tasks_is_zero():
+    merged = merge_statistics([worker_stats(0, 4, 0.0, 0.0, 0)] * 2)
+    assert merged['thread_pool']['avg_queue_wait'] == 0.0
+
+def test_disabled_sections_are_merged_with_enabled_ones():
+    cache = {'hits': 3, 'max_bytes': 1024}
+    merged = merge_statistics([worker_stats(1, 4, 0.1, 0.0, 0, cache=None),
+                               worker_stats(1, 4, 0.1, 0.0, 0, cache=cache),
+                               worker_stats(1, 4, 0.1, 0.0, 0, cache=dict(cache))])
+    assert merged['cache'] == {'hits': 6, 'max_bytes': 1024}
+
+def test_no_snapshots():
+    assert merge_statistics([]) == {}
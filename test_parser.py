@@ -0,0 +1,91 @@
+import pytest
+
+from file_server_lab2 import RequestError, RequestParser
+
+def test_head_split_across_reads():
+    parser = RequestParser()
+    parser.feed(b'GET /index.html HTTP/1.1\r\nHo')
+    assert parser.next_request() is None
+    
+    parser.feed(b'st: localhost\r\n\r')
+    assert parser.next_request() is None
+    
+    parser.feed(b'\n')
+    request = parser.next_request()
+    assert (request.method, request.path, request.version) == ('GET', '/index.html', 'HTTP/1.1')
+    assert request.headers == {'host': 'localhost'}
+    assert parser.buffer == b''
+
+def test_pipelined_requests_come_out_in_order():
+    parser = RequestParser()
+    parser.feed(b'POST /a HTTP/1.1\r\nContent-Length: 5\r\n\r\nhello'
+                b'GET /b HTTP/1.1\r\n\r\n'
+                b'GET /c HTTP/1.1\r\n')
+    
+    assert parser.next_request().path == '/a'
+    assert parser.next_request().path == '/b'
+    # The third head is incomplete and stays buffered.
+    assert parser.next_request() is None
+    parser.feed(b'\r\n')
+    assert parser.next_request().path == '/c'
+
+def test_waits_for_the_whole_body():
+    parser = RequestParser()
+    parser.feed(b'POST /a HTTP/1.1\r\nContent-Length: 10\r\n\r\nhello')
+    assert parser.next_request() is None
+    parser.feed(b'world')
+    assert parser.next_request().path == '/a'
+
+def test_bare_lf_line_endings():
+    parser = RequestParser()
+    parser.feed(b'GET /a HTTP/1.0\nHost: x\n\n')
+    request = parser.next_request()
+    assert request.path == '/a'
+    assert request.headers == {'host': 'x'}
+
+def test_request_line_without_version_is_http_1_0():
+    parser = RequestParser()
+    parser.feed(b'GET /a\r\n\r\n')
+    assert parser.next_request().version == 'HTTP/1.0'
+
+def test_oversized_head_without_terminator_is_431():
+    parser = RequestParser(max_header_size=64)
+    parser.feed(b'GET /a HTTP/1.1\r\nX-Filler: ' + b'x' * 100)
+    with pytest.raises(RequestError) as excinfo:
+        parser.next_request()
+    assert excinfo.value.status_code == 431
+
+def test_oversized_complete_head_is_431():
+    parser = RequestParser(max_header_size=64)
+    parser.feed(b'GET /a HTTP/1.1\r\nX-Filler: ' + b'x' * 100 + b'\r\n\r\n')
+    with pytest.raises(RequestError) as excinfo:
+        parser.next_request()
+    assert excinfo.value.status_code == 431
+
+def test_transfer_encoding_is_411():
+    parser = RequestParser()
+    parser.feed(b'POST /a HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n')
+    with pytest.raises(RequestError) as excinfo:
+        parser.next_request()
+    assert excinfo.value.status_code == 411
+
+def test_oversized_body_is_413():
+    parser = RequestParser(max_body_size=10)
+    parser.feed(b'POST /a HTTP/1.1\r\nContent-Length: 11\r\n\r\n')
+    with pytest.raises(RequestError) as excinfo:
+        parser.next_request()
+    assert excinfo.value.status_code == 413
+
+@pytest.mark.parametrize('head', [
+    b'GET /a HTTP/1.1\r\nContent-Length: ten\r\n\r\n',
+    b'GET /a HTTP/1.1\r\nContent-Length: -1\r\n\r\n',
+    b'GET /a HTTP/1.1\r\nNo colon here\r\n\r\n',
+    b'GET /a FTP/1.0\r\n\r\n',
+    b'GET /\xff HTTP/1.1\r\n\r\n'
+])
+def test_malformed_requests_are_400(head):
+    parser = RequestParser()
+    parser.feed(head)
+    with pytest.raises(RequestError) as excinfo:
+        parser.next_request()
+    assert excinfo.value.status_code == 400
@@ -0,0 +1,52 @@
+from email.utils import formatdate
+from types import SimpleNamespace
+
+import pytest
+
+from file_server_lab2 import MAX_RANGES
+
+ETAG = '"1-3e8-0"'
+ST = SimpleNamespace(st_size=1000, st_mtime=1700000000.0)
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-99', [(0, 99)]),
+    ('bytes=990-', [(990, 999)]),
+    ('bytes=-100', [(900, 999)]),
+    ('bytes=-5000', [(0, 999)]),
+    ('bytes=900-5000', [(900, 999)]),
+    ('bytes=0-0, -1', [(0, 0), (999, 999)]),
+    ('BYTES=0-9', [(0, 9)])
+])
+def test_satisfiable_ranges(server, header, expected):
+    assert server._parse_range_header(header, ST.st_size) == expected
+
+@pytest.mark.parametrize('header', ['bytes=1000-1100', 'bytes=5000-', 'bytes=-0'])
+def test_unsatisfiable_ranges_are_416(server, header):
+    # An empty list is answered with 416 Range Not Satisfiable.
+    assert server._parse_range_header(header, ST.st_size) == []
+
+@pytest.mark.parametrize('header', [
+    'items=0-9',
+    'bytes=',
+    'bytes=9-0',
+    'bytes=abc-',
+    'bytes=5',
+    'bytes=' + ','.join(['0-0'] * (MAX_RANGES + 1))
+])
+def test_invalid_ranges_send_the_whole_file(server, header):
+    assert server._parse_range_header(header, ST.st_size) is None
+
+def test_no_range_header(server):
+    assert server._requested_ranges({}, ETAG, ST) is None
+    assert server._requested_ranges(None, ETAG, ST) is None
+
+@pytest.mark.parametrize('if_range, expected', [
+    (ETAG, [(0, 99)]),
+    ('"other"', None),
+    ('W/' + ETAG, None),
+    (formatdate(ST.st_mtime, usegmt=True), [(0, 99)]),
+    (formatdate(ST.st_mtime - 60, usegmt=True), None)
+])
+def test_if_range(server, if_range, expected):
+    headers = {'range': 'bytes=0-99', 'if-range': if_range}
+    assert server._requested_ranges(headers, ETAG, ST) == expected
@@ -0,0 +1,53 @@
+import pytest
+
+import file_server_lab2
+from file_server_lab2 import TokenBucketLimiter
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replace time.monotonic with a clock the test advances by hand."""
+    now = [1000.0]
+    monkeypatch.setattr(file_server_lab2.time, 'monotonic', lambda: now[0])
+    return now
+
+def test_burst_then_deny(clock):
+    limiter = TokenBucketLimiter(rate=2, burst=3)
+    assert [limiter.allow('10.0.0.1') for _ in range(4)] == [True, True, True, False]
+
+def test_tokens_refill_at_rate(clock):
+    limiter = TokenBucketLimiter(rate=2, burst=3)
+    for _ in range(3):
+        limiter.allow('10.0.0.1')
+    
+    clock[0] += 0.25
+    assert not limiter.allow('10.0.0.1')
+    clock[0] += 0.25
+    assert limiter.allow('10.0.0.1')
+    assert not limiter.allow('10.0.0.1')
+
+def test_refill_is_capped_at_burst(clock):
+    limiter = TokenBucketLimiter(rate=10, burst=2, max_tracked_ips=10000)
+    limiter.allow('10.0.0.1')
+    clock[0] += 0.15
+    assert [limiter.allow('10.0.0.1') for _ in range(3)] == [True, True, False]
+
+def test_clients_have_separate_buckets(clock):
+    limiter = TokenBucketLimiter(rate=1)
+    assert limiter.allow('10.0.0.1')
+    assert not limiter.allow('10.0.0.1')
+    assert limiter.allow('10.0.0.2')
+
+def test_tracked_ips_are_bounded(clock):
+    limiter = TokenBucketLimiter(rate=1, num_stripes=1, max_tracked_ips=3)
+    for n in range(5):
+        limiter.allow(f'10.0.0.{n}')
+    assert limiter.get_statistics() == {'tracked_ips': 3, 'evictions': 2}
+    # The least recently seen client was evicted and starts with a full bucket.
+    assert limiter.allow('10.0.0.0')
+
+def test_idle_buckets_are_dropped(clock):
+    limiter = TokenBucketLimiter(rate=5, burst=10, num_stripes=1)
+    limiter.allow('10.0.0.1')
+    clock[0] += limiter.idle_timeout
+    limiter.allow('10.0.0.2')
+    assert limiter.get_statistics() == {'tracked_ips': 1, 'evictions': 1}
@@ -0,0 +1,52 @@
+import threading
+
+from file_server_lab2 import LatencyHistogram, ShardedCounter, release_thread_shards
+
+def run_in_thread(work, release):
+    """Run work in a thread that retires its shards once release is set."""
+    def target():
+        work()
+        release.wait()
+        release_thread_shards()
+    
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread
+
+def test_counts_survive_thread_exit():
+    counter = ShardedCounter()
+    release = threading.Event()
+    release.set()
+    threads = [run_in_thread(lambda: [counter.increment('a') for _ in range(50)], release)
+               for _ in range(4)]
+    for thread in threads:
+        thread.join()
+    
+    assert counter.snapshot() == {'a': 200}
+    assert len(counter._all_shards()) == 1
+
+def test_shard_retired_during_a_snapshot_is_counted_once():
+    counter = ShardedCounter()
+    histogram = LatencyHistogram()
+    
+    def work():
+        for _ in range(100):
+            counter.increment('a')
+            histogram.observe(('file',), 0.001)
+    
+    release = threading.Event()
+    thread = run_in_thread(work, release)
+    while sum(shard.get('a', 0) for shard in counter._all_shards()) < 100:
+        pass
+    
+    # A snapshot copies the shard list under the lock and merges outside it;
+    # retire the shard in between.
+    counter_shards = counter._all_shards()
+    histogram_shards = histogram._all_shards()
+    release.set()
+    thread.join()
+    
+    assert sum(shard.get('a', 0) for shard in counter_shards) == 100
+    assert sum(shard[('file',)][2] for shard in histogram_shards if shard) == 100
+    assert counter.snapshot() == {'a': 100}
+    assert histogram.snapshot()[('file',)][2] == 100